@@ -1,10 +1,49 @@
-import gzip
+import csv
+import errno
 import logging
+import os
 import shutil
+import subprocess
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING
 
+from bactopia.utils import read_cache, write_cache
 
-def search_path(path: str, pattern: str, recursive: bool = False) -> Path:
+if TYPE_CHECKING:
+    import pandas as pd
+
+GATHER_DIR = "main/gather"
+ASSEMBLER_DIR = "main/assembler"
+META_HEADER = b"sample\truntype\toriginal_runtype\tis_paired\tis_compressed\tspecies\tgenome_size\n"
+
+
+def _scandir_suffix(path: str, suffix: str, recursive: bool = False) -> str:
+    """
+    Yield files in a directory that end with a suffix
+
+    Args:
+        path (str): The directory to search
+        suffix (str): The suffix to match
+        recursive (bool): Search recursively
+
+    Returns:
+        str: A generator of paths ending with the suffix
+    """
+    dirs = [str(path)]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        dirs.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield entry.path
+
+
+def search_path(path: str, pattern: str, recursive: bool = False) -> str:
     """
     Search a directory for files matching a pattern
 
@@ -14,12 +53,16 @@ def search_path(path: str, pattern: str, recursive: bool = False) -> Path:
         recursive (bool): Search recursively
 
     Returns:
-        Path object: A generator of files matching the pattern
+        str: A generator of paths matching the pattern
     """
-    if recursive:
-        return Path(path).rglob(pattern)
+    # Simple '*.ext' patterns do not need glob's pattern matching
+    suffix = pattern[1:]
+    if pattern.startswith("*") and not any(c in suffix for c in "*?["):
+        return _scandir_suffix(path, suffix, recursive=recursive)
+    elif recursive:
+        return map(str, Path(path).rglob(pattern))
     else:
-        return Path(path).glob(pattern)
+        return map(str, Path(path).glob(pattern))
 
 
 def create_sample_directory(
@@ -32,48 +75,158 @@ def create_sample_directory(
         sample (str): The name of the sample
         assembly (str): The path to the assembly
         bactopia_dir (str): The path to the Bactopia directory
-        publish_mode (str): The method to publish the assembly (symlink or copy)
+        publish_mode (str): The method to publish the assembly (symlink, hardlink or copy)
 
     Returns:
         bool: True if the directory was created, False otherwise
     """
-    logging.debug(f"Creating {sample} directory ({bactopia_dir}/{sample})")
-    sample_dir = Path(f"{bactopia_dir}/{sample}")
-    if not sample_dir.exists():
-        sample_dir.mkdir(parents=True, exist_ok=True)
-
-    # Make remaining subdirectories (which will be empty)
-    Path(f"{bactopia_dir}/{sample}/main").mkdir(parents=True, exist_ok=True)
-    Path(f"{bactopia_dir}/{sample}/main/gather").mkdir(parents=True, exist_ok=True)
-    Path(f"{bactopia_dir}/{sample}/main/assembler").mkdir(parents=True, exist_ok=True)
+    sample_dir = f"{bactopia_dir}/{sample}"
+    gather_dir = f"{sample_dir}/{GATHER_DIR}"
+    assembler_dir = f"{sample_dir}/{ASSEMBLER_DIR}"
+    # Called once per sample, so skip formatting debug messages unless needed
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug:
+        logging.debug(f"Creating {sample} directory ({sample_dir})")
+    # The leaf directories imply the sample and main directories
+    os.makedirs(gather_dir, exist_ok=True)
+    os.makedirs(assembler_dir, exist_ok=True)
 
     # Write the meta.tsv file
-    logging.debug(f"Writing {sample}-meta.tsv")
+    if debug:
+        logging.debug(f"Writing {sample}-meta.tsv")
     is_compressed = "true" if str(assembly).endswith(".gz") else "false"
-    with open(f"{bactopia_dir}/{sample}/main/gather/{sample}-meta.tsv", "w") as meta_fh:
-        meta_fh.write(
-            "sample\truntype\toriginal_runtype\tis_paired\tis_compressed\tspecies\tgenome_size\n"
-        )
-        meta_fh.write(
-            f"{sample}\tassembly_accession\tassembly_accession\tfalse\t{is_compressed}\tnull\t0\n"
-        )
+    meta = f"{sample}\tassembly_accession\tassembly_accession\tfalse\t{is_compressed}\tnull\t0\n"
+    meta_fd = os.open(
+        f"{gather_dir}/{sample}-meta.tsv",
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+        0o666,
+    )
+    try:
+        os.write(meta_fd, META_HEADER + meta.encode())
+    finally:
+        os.close(meta_fd)
 
     # Write the assembly file
-    final_assembly = f"{bactopia_dir}/{sample}/main/assembler/{sample}.fna"
+    final_assembly = f"{assembler_dir}/{sample}.fna"
     if is_compressed:
         final_assembly = f"{final_assembly}.gz"
-    final_assembly_path = Path(final_assembly)
 
     if publish_mode == "symlink":
-        logging.debug(f"Creating symlink of {assembly} at {final_assembly}")
-        final_assembly_path.symlink_to(assembly)
+        if debug:
+            logging.debug(f"Creating symlink of {assembly} at {final_assembly}")
+        os.symlink(os.fspath(assembly), final_assembly)
+    elif publish_mode == "hardlink":
+        if debug:
+            logging.debug(f"Creating hardlink of {assembly} at {final_assembly}")
+        try:
+            os.link(assembly, final_assembly)
+        except OSError as e:
+            # Hardlinks can't cross filesystems, fall back to a copy
+            if e.errno != errno.EXDEV:
+                raise
+            if debug:
+                logging.debug(f"Copying {assembly} to {final_assembly} (cross-device)")
+            shutil.copyfile(assembly, final_assembly)
     else:
-        logging.debug(f"Copying {assembly} to {final_assembly}")
+        if debug:
+            logging.debug(f"Copying {assembly} to {final_assembly}")
         shutil.copyfile(assembly, final_assembly)
 
     return True
 
 
+def create_sample_directories(
+    samples: list,
+    bactopia_dir: str,
+    publish_mode: str = "symlink",
+    max_workers: int = None,
+) -> int:
+    """
+    Create the Bactopia directory structure for many samples at once
+
+    Args:
+        samples (list): A list of (sample name, assembly path) tuples
+        bactopia_dir (str): The path to the Bactopia directory
+        publish_mode (str): The method to publish the assembly (symlink, hardlink or copy)
+        max_workers (int, optional): threads used to create directories. Defaults to None.
+
+    Returns:
+        int: The number of sample directories created
+    """
+    # Creating directories and links is I/O bound, so spread it across threads
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        created = executor.map(
+            lambda sample: create_sample_directory(
+                sample[0], sample[1], bactopia_dir, publish_mode
+            ),
+            samples,
+        )
+        return sum(created)
+
+
+def extract_archive_samples(
+    archive: str, members: dict, stop: threading.Event = None
+) -> list:
+    """
+    Stream through an ATB archive and write out only the requested samples
+
+    Args:
+        archive (str): The path to the tar.xz archive
+        members (dict): Paths inside the archive mapped to where they should be written
+        stop (threading.Event, optional): Stop extracting once set. Defaults to None.
+
+    Returns:
+        list: The paths of the samples written out
+    """
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    extracted = []
+    with tarfile.open(archive, "r|xz") as tf:
+        for member in tf:
+            if stop is not None and stop.is_set():
+                break
+            if member.isfile() and member.name in members:
+                sample_out = members[member.name]
+                if debug:
+                    logging.debug(f"Extracting {member.name} to {sample_out}")
+                # Write to a temporary file, so an interrupted run never leaves a
+                # truncated sample at its final path
+                sample_tmp = f"{sample_out}.tmp"
+                try:
+                    with tf.extractfile(member) as src, open(sample_tmp, "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                except BaseException:
+                    if os.path.exists(sample_tmp):
+                        os.remove(sample_tmp)
+                    raise
+                os.replace(sample_tmp, sample_out)
+                extracted.append(sample_out)
+                if len(extracted) == len(members):
+                    break
+    return extracted
+
+
+def _read_file_list(file_list) -> "pd.DataFrame":
+    """
+    Read the ATB file list into a DataFrame of strings
+
+    Args:
+        file_list (str|file): The path to, or a handle of, the ATB file list
+
+    Returns:
+        pd.DataFrame: The columns of the ATB file list
+    """
+    # Only bactopia-atb-downloader parses the file list, so load pandas on demand
+    import pandas as pd
+
+    return pd.read_csv(
+        file_list,
+        sep="\t",
+        dtype=str,
+        na_filter=False,
+        quoting=csv.QUOTE_NONE,
+    )
+
+
 def parse_atb_file_list(file_list: str) -> list:
     """
     Parse the ATB file list to get the sample name and assembly path
@@ -92,52 +245,76 @@ def parse_atb_file_list(file_list: str) -> list:
 
     Where the first line is the header and the remaining lines are the data.
 
+    The parsed results are cached next to the file list (as a pickle) and reused
+    on later calls, as long as the file list has not been modified since.
+
     Docs URL: https://allthebacteria.readthedocs.io/en/latest/assemblies.html#downloading-assemblies
 
     Args:
         file_list (str): The path to the ATB file list
 
     Returns:
-        list: A list of two dictionaries
-            samples: A dictionary of dictionaries for sample names and associated columns
+        list: A list of a DataFrame and two dictionaries
+            samples: A DataFrame, indexed by sample name, of the associated columns
             archives: A dictionary of dictionaries for tar.xz archives and associated columns
             species: A dictionary of lists of samples for each species
     """
-    samples = {}
-    archives = {}
-    species = {}
-    with gzip.open(file_list, "rt") as fh:
-        header = None
-        for line in fh:
-            line = line.rstrip()
-            if header is None:
-                header = line.split("\t")
-            else:
-                cols = line.split("\t")
-                row = dict(zip(header, cols))
-
-                # Capture information for each sample
-                samples[row["sample"]] = {
-                    "species_sylph": row["species_sylph"],
-                    "species_miniphy": row["species_miniphy"],
-                    "tar_xz": row["tar_xz"],
-                    "filename": row["filename_in_tar_xz"],
-                }
-
-                # Reduce duplicates with a archive dictionary
-                if row["tar_xz"] not in archives:
-                    archives[row["tar_xz"]] = {
-                        "url": row["tar_xz_url"],
-                        "md5": row["tar_xz_md5"],
-                        "size": row["tar_xz_size_MB"],
-                    }
-
-                # Reduce duplicates with a species dictionary
-                if row["species_sylph"] not in species:
-                    species[row["species_sylph"]] = []
-                species[row["species_sylph"]].append(row["sample"])
+    cache = str(file_list)
+    if cache.endswith(".tsv.gz"):
+        cache = cache[: -len(".tsv.gz")]
+    cache = f"{cache}.pkl"
+    if os.path.exists(cache) and os.path.getmtime(cache) > os.path.getmtime(file_list):
+        cached = read_cache(cache)
+        if cached is not None:
+            logging.debug(f"Using cached ATB file list: {cache}")
+            return cached
+
+    import pandas as pd
+
+    # pigz decompresses in a separate process, leaving this one to parse
+    df = None
+    pigz = shutil.which("pigz")
+    if pigz and str(file_list).endswith(".gz"):
+        logging.debug(f"Decompressing {file_list} with {pigz}")
+        with subprocess.Popen(
+            [pigz, "-dc", str(file_list)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ) as proc:
+            try:
+                df = _read_file_list(proc.stdout)
+            except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+                logging.debug(f"Unable to parse pigz output: {e}")
+        if proc.returncode != 0:
+            logging.debug(f"pigz exited with {proc.returncode}, falling back to gzip")
+            df = None
+
+    if df is None:
+        df = _read_file_list(file_list)
+
+    # Reduce duplicates with a species dictionary, grouped in order of appearance
+    species = df.groupby("species_sylph", sort=False)["sample"].agg(list).to_dict()
+
+    # Reduce duplicates with a archive dictionary
+    archives = (
+        df.drop_duplicates("tar_xz")
+        .set_index("tar_xz")[["tar_xz_url", "tar_xz_md5", "tar_xz_size_MB"]]
+        .rename(
+            columns={"tar_xz_url": "url", "tar_xz_md5": "md5", "tar_xz_size_MB": "size"}
+        )
+        .to_dict("index")
+    )
+
+    # Repeated values are stored once as categories, rather than one dict per sample
+    samples = df.set_index("sample")[
+        ["species_sylph", "species_miniphy", "tar_xz", "filename_in_tar_xz"]
+    ].rename(columns={"filename_in_tar_xz": "filename"})
+    for col in ["species_sylph", "species_miniphy", "tar_xz"]:
+        samples[col] = samples[col].astype("category")
+    samples = samples[~samples.index.duplicated(keep="last")]
 
     logging.debug(f"Found {len(samples)} samples in {file_list}")
     logging.debug(f"Found {len(archives)} archives in {file_list}")
     logging.debug(f"Found {len(species)} species in {file_list}")
+    write_cache(cache, [samples, archives, species])
     return [samples, archives, species]
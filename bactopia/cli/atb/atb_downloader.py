@@ -1,28 +1,31 @@
 import logging
 import os
+import shutil
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-from rich.logging import RichHandler
 
 import bactopia
-from bactopia.atb import parse_atb_file_list
+from bactopia.atb import extract_archive_samples, parse_atb_file_list
 from bactopia.ncbi import is_biosample, taxid2name
 from bactopia.utils import (
     download_url,
-    execute,
     file_exists,
+    get_session,
+    gzip_file,
     mkdir,
-    pgzip,
+    split_gzip_cpus,
     validate_file,
 )
 
+# Limit concurrent downloads to avoid being throttled by the server
+MAX_DOWNLOADS = 8
+
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.OPTION_GROUPS = {
     "bactopia-atb-downloader": [
@@ -148,6 +151,14 @@ def atb_downloader(
     silent,
 ):
     """Download All-the-Bacteria assemblies based on input query"""
+    # Rich tracebacks and logging pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+    from rich.logging import RichHandler
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
+
     # Setup logs
     logging.basicConfig(
         format="%(asctime)s:%(name)s:%(levelname)s - %(message)s",
@@ -181,10 +192,9 @@ def atb_downloader(
     archives_to_download = {}
     if is_biosample(query):
         logging.info(f"Query is a BioSample: {query}")
-        if query in samples:
-            archives_to_download[samples[query]["tar_xz"]] = archives[
-                samples[query]["tar_xz"]
-            ]
+        if query in samples.index:
+            tar_xz = samples.at[query, "tar_xz"]
+            archives_to_download[tar_xz] = archives[tar_xz]
             matched_samples.append(query)
         else:
             logging.error(f"Sample not found in ATB file list: {query}")
@@ -200,10 +210,8 @@ def atb_downloader(
         logging.info(f"Query is a species: {query_species}")
 
         if query_species in species:
-            for sample in species[query_species]:
-                archives_to_download[samples[sample]["tar_xz"]] = archives[
-                    samples[sample]["tar_xz"]
-                ]
+            for tar_xz in samples.loc[species[query_species], "tar_xz"].unique():
+                archives_to_download[tar_xz] = archives[tar_xz]
         else:
             logging.error(f"Species not found in ATB file list: {query_species}")
             sys.exit(1)
@@ -215,7 +223,8 @@ def atb_downloader(
         total_size += float(info["size"])
 
     logging.info(f"Found {len(matched_samples)} samples to extract")
-    logging.debug(f"Samples: {matched_samples}")
+    if verbose:
+        logging.debug(f"Samples: {matched_samples}")
     logging.info(
         f"Found {len(archives_to_download)} archives (~{int(total_size):,} MB) to download"
     )
@@ -225,105 +234,149 @@ def atb_downloader(
 
     # Check if archives exist, otherwise download
     if not dry_run:
+        # Determine where each sample belongs and which still need extracting, each
+        # species directory is listed once rather than checking every sample path
+        species_dirs = {}
+        needs_compression = []
+        needs_extraction = {}
+        matched_info = samples.loc[matched_samples]
+        # Debug messages are only formatted with --verbose, this loop runs per sample
+        for i, info in enumerate(matched_info.itertuples()):
+            sample = info.Index
+            if verbose:
+                logging.debug(
+                    f"Checking sample {i+1} of {len(matched_samples)}: {sample}"
+                )
+            if info.species_sylph not in species_dirs:
+                species = info.species_sylph.lower().replace(" ", "_")
+                species_dir = str(mkdir(f"{outdir}/{species}"))
+                existing = set()
+                with os.scandir(species_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".tmp"):
+                            # Left behind by an interrupted extraction
+                            os.remove(entry.path)
+                        else:
+                            existing.add(entry.name)
+                species_dirs[info.species_sylph] = (species_dir, existing)
+            species_dir, existing = species_dirs[info.species_sylph]
+
+            sample_filename = info.filename.rsplit("/", 1)[-1]
+            sample_out = f"{species_dir}/{sample_filename}"
+            if sample_filename in existing and not force:
+                if verbose:
+                    logging.debug(
+                        f"Sample already exists: {sample_out}...skipping unless --force provided"
+                    )
+
+                # Compress unless --uncompressed provided
+                if not uncompressed:
+                    needs_compression.append(sample_out)
+            elif f"{sample_filename}.gz" in existing and not force:
+                if verbose:
+                    logging.debug(
+                        f"Sample already exists: {sample_out}.gz...skipping unless --force provided"
+                    )
+            else:
+                if info.tar_xz not in needs_extraction:
+                    needs_extraction[info.tar_xz] = {}
+                needs_extraction[info.tar_xz][info.filename] = sample_out
+
+        # Run download -> extract -> compress as a pipeline, so an archive is
+        # extracted as soon as it is downloaded, and its samples compressed as soon
+        # as they are extracted. Downloads are network bound and share connections,
+        # extraction and compression each get half of the CPUs.
         logging.info(f"Downloading archives to: {outdir}/archives")
         mkdir(f"{outdir}/archives")
-        for archive, info in archives_to_download.items():
+        with os.scandir(f"{outdir}/archives") as entries:
+            existing_archives = {entry.name for entry in entries if entry.is_file()}
+        max_downloads = min(cpus, MAX_DOWNLOADS)
+        session = get_session(pool_size=max_downloads)
+        extract_cpus = max(1, cpus // 2)
+        gzip_jobs, gzip_threads = split_gzip_cpus(max(1, cpus - extract_cpus))
+        stages = {}
+        stop = threading.Event()
+        total_compressed = 0
+        downloader = ThreadPoolExecutor(max_workers=max_downloads)
+        extractor = ThreadPoolExecutor(max_workers=extract_cpus)
+        compressor = ThreadPoolExecutor(max_workers=gzip_jobs)
+
+        def extract(archive: str) -> None:
             archive_path = f"{str(outdir)}/archives/{archive}"
-            if file_exists(archive_path):
-                logging.info(f"Using existing archive: {archive_path}")
-                archive_path = validate_file(archive_path)
-            else:
-                logging.info(f"Downloading archive to: {archive_path}")
-                if dry_run:
-                    logging.info(f"Would download: {info['url']} to {archive_path}")
-                else:
-                    archive_path = download_url(info["url"], archive_path, progress)
+            logging.info(f"Extracting: {archive_path}")
+            job = extractor.submit(
+                extract_archive_samples, archive_path, needs_extraction[archive], stop
+            )
+            stages[job] = ("extract", archive)
+
+        def compress(sample_out: str) -> None:
+            job = compressor.submit(gzip_file, sample_out, gzip_threads)
+            stages[job] = ("compress", sample_out)
+
+        for sample_out in needs_compression:
+            compress(sample_out)
 
-        # Extract each of the archives
-        cleanup = []
         for archive, info in archives_to_download.items():
             archive_path = f"{str(outdir)}/archives/{archive}"
-            if dry_run:
-                logging.info(f"Would have extracted: {archive_path}")
+            if archive in existing_archives:
+                logging.info(f"Using existing archive: {archive_path}")
+                if archive in needs_extraction:
+                    extract(archive)
             else:
-                logging.info(f"Extracting: {archive_path}")
-                stdout, stderr = execute(
-                    f"tar xf {archive_path} -C {outdir}", capture=True, allow_fail=True
+                logging.info(f"Downloading archive to: {archive_path}")
+                job = downloader.submit(
+                    download_url,
+                    info["url"],
+                    archive_path,
+                    progress,
+                    session,
+                    info["md5"],
+                    stop,
                 )
-                cleanup_dir = f"{outdir}/{archive.replace('.tar.xz', '')}"
-                logging.debug(f"Adding {cleanup_dir} to cleanup list")
-                cleanup.append(f"{outdir}/{archive.replace('.tar.xz', '')}")
-    else:
-        logging.info("Would have downloaded and extracted archives")
+                stages[job] = ("download", archive)
 
-    # Move samples into species directories, then compress
-    species_dirs = {}
-    needs_compression = []
-    if not dry_run:
-        logging.info(f"Moving {len(matched_samples)} samples to: {outdir}")
-        for i, sample in enumerate(matched_samples):
-            logging.debug(f"Moving sample {i+1} of {len(matched_samples)}: {sample}")
-            info = samples[sample]
-            species = info["species_sylph"].lower().replace(" ", "_")
-            if species not in species_dirs:
-                species_dirs[species] = True
-                mkdir(f"{outdir}/{species}")
-
-            archive_file = f"{outdir}/{info['filename']}"
-            if file_exists(archive_file):
-                sample_filename = info["filename"].split("/")[-1]
-                sample_out = f"{outdir}/{species}/{sample_filename}"
-
-                if file_exists(archive_file):
-                    if (file_exists(sample_out) and not force) or ():
-                        logging.debug(
-                            f"Sample already exists: {sample_out}...skipping unless --force provided"
-                        )
+        try:
+            while stages:
+                done, _ = wait(stages, return_when=FIRST_COMPLETED)
+                for job in done:
+                    stage, name = stages.pop(job)
+                    result = job.result()
+                    if stage == "download":
+                        logging.debug(f"Downloaded: {result}")
+                        if name in needs_extraction:
+                            extract(name)
+                    elif stage == "extract":
+                        found = set(result)
+                        for filename, sample_out in needs_extraction[name].items():
+                            if sample_out not in found:
+                                logging.warning(f"Unable to find {filename}")
 
                         # Compress unless --uncompressed provided
                         if not uncompressed:
-                            needs_compression.append(sample_out)
-                    elif file_exists(f"{sample_out}.gz") and not force:
-                        logging.debug(
-                            f"Sample already exists: {sample_out}.gz...skipping unless --force provided"
-                        )
+                            for sample_out in result:
+                                compress(sample_out)
                     else:
-                        logging.debug(f"Moving {archive_file} to {sample_out}")
-                        stdout, stderr = execute(
-                            f"mv {archive_file} {sample_out}",
-                            capture=True,
-                            allow_fail=True,
-                        )
-
-                        # Compress unless --uncompressed provided
-                        if not uncompressed:
-                            needs_compression.append(sample_out)
-                else:
-                    logging.warning(f"Unable to find {info['filename']}")
-            else:
-                logging.warning(f"{outdir}/{info['filename']}")
-
-        # Compress samples
-        if len(needs_compression):
-            logging.info(f"Compressing {len(needs_compression)} samples")
-            pgzip(needs_compression, cpus)
-
-        # Cleanup
-        for archive in cleanup:
-            if file_exists(archive):
-                logging.info(f"Removing extracted files: {archive}")
-                stdout, stderr = execute(
-                    f"rm -rf {archive}", capture=True, allow_fail=True
-                )
+                        total_compressed += 1
+        except BaseException:
+            # Stop the downloads and extractions already running
+            stop.set()
+            raise
+        finally:
+            # If a stage fails, exit without starting the archives still queued
+            for job in stages:
+                job.cancel()
+            for executor in [downloader, extractor, compressor]:
+                executor.shutdown(wait=False)
+        if total_compressed:
+            logging.info(f"Compressed {total_compressed} samples")
 
         if remove_archives:
             logging.info(
-                "Provided --remove-archives, removing all downloaded archives in {outdir}/archives"
-            )
-            stdout, stderr = execute(
-                f"rm -rf {outdir}/archives", capture=True, allow_fail=True
+                f"Provided --remove-archives, removing all downloaded archives in {outdir}/archives"
             )
+            shutil.rmtree(f"{outdir}/archives", ignore_errors=True)
     else:
+        logging.info("Would have downloaded and extracted archives")
         logging.info(
             "Would have moved samples to species directories and cleaned up archives"
         )
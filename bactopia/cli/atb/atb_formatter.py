@@ -1,21 +1,18 @@
 import logging
+import os
 import shutil
 import sys
 from pathlib import Path
 
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-from rich.logging import RichHandler
 
 import bactopia
-from bactopia.atb import create_sample_directory, search_path
+from bactopia.atb import create_sample_directories, search_path
 from bactopia.utils import validate_file
 
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.OPTION_GROUPS = {
     "bactopia-atb-formatter": [
@@ -32,6 +29,7 @@ click.rich_click.OPTION_GROUPS = {
         {
             "name": "Additional Options",
             "options": [
+                "--cpus",
                 "--verbose",
                 "--silent",
                 "--version",
@@ -62,7 +60,7 @@ click.rich_click.OPTION_GROUPS = {
     "-m",
     default="symlink",
     show_default=True,
-    type=click.Choice(["symlink", "copy"], case_sensitive=False),
+    type=click.Choice(["symlink", "hardlink", "copy"], case_sensitive=False),
     help="Specifies how assemblies will be saved in the Bactopia directory",
 )
 @click.option(
@@ -75,6 +73,13 @@ click.rich_click.OPTION_GROUPS = {
 @click.option(
     "--recursive", "-r", is_flag=True, help="Traverse recursively through provided path"
 )
+@click.option(
+    "--cpus",
+    type=click.IntRange(min=1),
+    default=32,
+    show_default=True,
+    help="The number of threads to use for creating sample directories",
+)
 @click.option("--verbose", is_flag=True, help="Increase the verbosity of output")
 @click.option("--silent", is_flag=True, help="Only critical errors will be printed")
 def atb_formatter(
@@ -83,10 +88,19 @@ def atb_formatter(
     publish_mode,
     extension,
     recursive,
+    cpus,
     verbose,
     silent,
 ):
     """Restructure All-the-Bacteria assemblies to allow usage with Bactopia Tools"""
+    # Rich tracebacks and logging pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+    from rich.logging import RichHandler
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
+
     # Setup logs
     logging.basicConfig(
         format="%(asctime)s:%(name)s:%(levelname)s - %(message)s",
@@ -103,14 +117,16 @@ def atb_formatter(
     abspath = validate_file(path)
 
     # Match Assemblies
-    count = 0
     logging.info(
         "Setting up Bactopia directory structure (use --verbose to see more details)"
     )
-    for fasta in search_path(abspath, f"*{extension}", recursive=recursive):
-        fasta_name = fasta.name.replace(extension, "")
-        create_sample_directory(fasta_name, fasta, bactopia_dir, publish_mode)
-        count += 1
+    samples = [
+        (os.path.basename(fasta).replace(extension, ""), fasta)
+        for fasta in search_path(abspath, f"*{extension}", recursive=recursive)
+    ]
+    count = create_sample_directories(
+        samples, bactopia_dir, publish_mode, max_workers=cpus
+    )
     logging.info(f"Bactopia directory structure created at {bactopia_dir}")
     logging.info(f"Total assemblies processed: {count}")
 
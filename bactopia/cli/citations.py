@@ -1,19 +1,16 @@
+import os
 import sys
+from functools import lru_cache
 
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-import yaml
 from rich.console import Console
-from rich.markdown import Markdown
 
 import bactopia
 from bactopia.utils import validate_file
 
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 
 
@@ -27,13 +24,30 @@ def parse_citations(yml: str) -> list:
     Returns:
         list: A list of dictionaries containing citation information
     """
+    return _load_citations(str(yml), os.path.getmtime(yml))
+
+
+@lru_cache(maxsize=4)
+def _load_citations(yml: str, mtime: float) -> list:
+    """
+    Load and index a citations.yml file, cached on its path and modification time
+
+    Args:
+        yml (str): A yaml file containing citations
+        mtime (float): The modification time of the yaml file
+
+    Returns:
+        list: A list of dictionaries containing citation information
+    """
+    # Only pay for importing yaml when citations are actually loaded
+    from bactopia.parsers.generic import parse_yaml
+
     module_citations = {}
-    with open(yml, "rt") as yml_fh:
-        citations = yaml.safe_load(yml_fh)
-        for group, refs in citations.items():
-            for ref, vals in refs.items():
-                module_citations[ref.lower()] = vals
-        return [citations, module_citations]
+    citations = parse_yaml(yml)
+    for group, refs in citations.items():
+        for ref, vals in refs.items():
+            module_citations[ref.lower()] = vals
+    return [citations, module_citations]
 
 
 @click.command()
@@ -48,6 +62,12 @@ def parse_citations(yml: str) -> list:
 @click.option("--plain-text", "-p", is_flag=True, help="Disable rich formatting")
 def citations(bactopia_path: str, name: str, plain_text: bool) -> None:
     """Print out tools and citations used throughout Bactopia"""
+    # Rich tracebacks pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 
     citations_yml = validate_file(f"{bactopia_path}/citations.yml")
     citations, module_citations = parse_citations(citations_yml)
@@ -73,6 +93,8 @@ def citations(bactopia_path: str, name: str, plain_text: bool) -> None:
     if plain_text:
         md = "\n".join(markdown)
     else:
+        from rich.markdown import Markdown
+
         md = Markdown("\n".join(markdown))
     console = Console(color_system=None if plain_text else "auto")
     console.print(md)
@@ -1,23 +1,27 @@
 import logging
 import os
+import re
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-from rich.logging import RichHandler
 
 import bactopia
-from bactopia.utils import execute, validate_file
+from bactopia.utils import (
+    BACTOPIA_CACHEDIR,
+    download_url,
+    get_nextflow_config,
+    get_session,
+    validate_file,
+)
 
-BACTOPIA_CACHEDIR = os.getenv("BACTOPIA_CACHEDIR", f"{Path.home()}/.bactopia")
+MAX_DOWNLOADS = 4
+URL_PARAM = re.compile(r"^(\S*_url) = (.*)$", re.MULTILINE)
 
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.OPTION_GROUPS = {
     # Use underscores in parameters, since these are also passed to Nextflow
@@ -47,49 +51,32 @@ click.rich_click.OPTION_GROUPS = {
 def parse_urls(bactopia_path, datasets_path):
     """Parse Bactopia's workflows.conf to get modules per-workflow"""
     urls = []
-    nf_config, stderr = execute(
-        f"nextflow config -flat {bactopia_path}/main.nf", capture=True
-    )
-    for line in nf_config.split("\n"):
-        if "_url =" in line:
-            param, val = line.split(" = ")
-            param = param.replace("params.", "")
-            val = val.replace("'", "")
-            urls.append(
-                {
-                    "dataset": param.split("_")[0],
-                    "url": val,
-                    "save_path": val.replace(
-                        "https://datasets.bactopia.com/datasets/", f"{datasets_path}/"
-                    ),
-                }
-            )
+    nf_config = get_nextflow_config(bactopia_path, BACTOPIA_CACHEDIR)
+    for param, val in URL_PARAM.findall(nf_config):
+        param = param.replace("params.", "")
+        val = val.replace("'", "")
+        urls.append(
+            {
+                "dataset": param.split("_")[0],
+                "url": val,
+                "save_path": val.replace(
+                    "https://datasets.bactopia.com/datasets/", f"{datasets_path}/"
+                ),
+            }
+        )
 
     return urls
 
 
-def download_file(url, save_path, max_retry=5):
-    """Download file, with chance to retry."""
-    retry = 0
-    allow_fail = False
-    success = False
-
+def download_file(url, save_path, max_retry=5, session=None):
+    """Download file, retrying failed requests with a backoff."""
     # Make sure the directory exists
-    if not Path(save_path).parent.exists():
-        Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-
-    while not success:
-        result = execute(f"wget -O {save_path} {url}", allow_fail=allow_fail)
-        if not result:
-            if retry > max_retry:
-                allow_fail = True
-            retry += 1
-            logging.error("Error downloading file, retrying after short sleep.")
-            time.sleep(30 * retry)
-        else:
-            success = True
+    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
 
-    return success
+    if session is None:
+        session = get_session(retries=max_retry)
+    download_url(url, save_path, False, session=session)
+    return True
 
 
 @click.command(
@@ -134,6 +121,14 @@ def datasets(
     unknown,
 ):
     """Download optional datasets to supplement your analyses with Bactopia"""
+    # Rich tracebacks and logging pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+    from rich.logging import RichHandler
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
+
     # Setup logs
     logging.basicConfig(
         format="%(asctime)s:%(name)s:%(levelname)s - %(message)s",
@@ -153,6 +148,7 @@ def datasets(
 
     # Current Bactopia workflows
     workflow_urls = parse_urls(bactopia_path, datasets_path)
+    needs_download = []
     for url in workflow_urls:
         if Path(url["save_path"]).exists() and not force:
             logging.warn(
@@ -160,7 +156,23 @@ def datasets(
             )
         else:
             logging.info(f"Downloading {url['dataset']} dataset to {url['save_path']}")
-            download_file(url["url"], url["save_path"], max_retry)
+            needs_download.append(url)
+
+    # Datasets are independent, so overlap a few downloads on the shared session
+    session = get_session(pool_size=MAX_DOWNLOADS, retries=max_retry)
+    executor = ThreadPoolExecutor(max_workers=MAX_DOWNLOADS)
+    downloads = [
+        executor.submit(download_file, url["url"], url["save_path"], max_retry, session)
+        for url in needs_download
+    ]
+    try:
+        for download in as_completed(downloads):
+            download.result()
+    finally:
+        # If a download fails, exit without starting the ones still queued
+        for download in downloads:
+            download.cancel()
+        executor.shutdown(wait=False)
 
 
 def main():
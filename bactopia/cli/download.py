@@ -1,27 +1,36 @@
+import http.client
 import logging
 import os
+import random
+import re
+import socket
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
 
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-from rich.logging import RichHandler
 
 import bactopia
-from bactopia.utils import execute, validate_file
+from bactopia.utils import (
+    BACTOPIA_CACHEDIR,
+    execute,
+    get_nextflow_config,
+    validate_file,
+)
 
-BACTOPIA_CACHEDIR = os.getenv("BACTOPIA_CACHEDIR", f"{Path.home()}/.bactopia")
 CONDA_CACHEDIR = os.getenv("NXF_CONDA_CACHEDIR", f"{BACTOPIA_CACHEDIR}/conda")
 SINGULARITY_CACHEDIR = os.getenv(
     "NXF_SINGULARITY_CACHEDIR", f"{BACTOPIA_CACHEDIR}/singularity"
 )
 
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.OPTION_GROUPS = {
     # Use underscores in parameters, since these are also passed to Nextflow
@@ -40,6 +49,7 @@ click.rich_click.OPTION_GROUPS = {
                 "--singularity_pull_docker_container",
                 "--force-rebuild",
                 "--max_retry",
+                "--jobs",
             ],
         },
         {
@@ -53,115 +63,179 @@ click.rich_click.OPTION_GROUPS = {
         },
     ]
 }
-BUILT_ALREADY = {"conda": {}, "singularity": {}}
+BUILT_ALREADY = set()
+CONDA_NAME = str.maketrans({"=": "-", ":": "-", " ": "-"})
+DOCKER_IMAGES = {}
+DOCKER_SOCKET = "/var/run/docker.sock"
+EXISTS_CACHE = {}
+IMAGE_NAME = str.maketrans({":": "-", "/": "-"})
+LIST_DELETE = str.maketrans("", "", "[]',")
+RETRY_MAX_SLEEP = 120
+BUILD_LOCKS = {}
+BUILD_LOCKS_GUARD = threading.Lock()
+# Conda and Mamba can't safely share their package cache between concurrent creates
+CONDA_LOCK = threading.Lock()
+CONDA_TOOLS = re.compile(r'^\s*conda_tools\s*=\s*"([^"]*)"', re.MULTILINE)
+CONTAINER_ENGINE = re.compile(
+    r"^\s*container\b.*containerEngine.*\n\s*'([^'\s]+)'.*\n\s*'([^']+)'",
+    re.MULTILINE,
+)
+CONTAINER = re.compile(r"^\s*container\s+'([^']+)'", re.MULTILINE)
+WORKFLOW_PARAM = re.compile(
+    r"^params\.(available_workflows|workflows)\.(\S+) = (.*)$", re.MULTILINE
+)
+
+
+class DockerSocketConnection(http.client.HTTPConnection):
+    """An HTTP connection to the Docker Engine API over its unix socket"""
+
+    def __init__(self, socket_path: str, timeout: float = 10):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # An unresponsive daemon should not hang the build threads
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def build_lock(path: str) -> threading.Lock:
+    """
+    Get the lock for an environment, so it is only built by one job at a time
+
+    Args:
+        path (str): The Singularity image path or Docker image being built
+
+    Returns:
+        threading.Lock: The lock for the given path
+    """
+    with BUILD_LOCKS_GUARD:
+        if path not in BUILD_LOCKS:
+            BUILD_LOCKS[path] = threading.Lock()
+        return BUILD_LOCKS[path]
+
+
+def path_exists(path: str) -> bool:
+    """
+    Check if a path exists, remembering the answer for the rest of the run
+
+    Args:
+        path (str): The path to check
+
+    Returns:
+        bool: True if the path exists, False otherwise
+    """
+    if path not in EXISTS_CACHE:
+        EXISTS_CACHE[path] = os.path.exists(path)
+    return EXISTS_CACHE[path]
 
 
 def cleanup_value(value):
     """Remove some characters Nextflow param values"""
     if value.startswith("["):
         # return a list
-        return value.lstrip("[").rstrip("]").replace("'", "").replace(",", "").split()
+        return value.translate(LIST_DELETE).split()
     elif value == "true" or value == "false":
         return bool(value)
     else:
-        return value.lstrip("'").rstrip("'").replace("\\", "")
+        return value.strip("'").replace("\\", "")
 
 
+@lru_cache(maxsize=None)
 def parse_module(main_nf):
-    """Pull out the Conda, Docker and singularity info"""
+    """Pull out the Conda, Docker and singularity info
+
+    Modules are shared by many workflows, so results are cached per main.nf and
+    should be treated as read-only.
+    """
     envs = {}
-    with open(main_nf, "rt") as main_fh:
-        read_container = 0
-        for line in main_fh:
-            line = line.strip()
-            if line.startswith("conda_tools"):
-                # Conda
-                envs["conda"] = (
-                    line.replace("conda_tools", "")
-                    .lstrip()
-                    .replace("= ", "")
-                    .replace('"', "")
-                )
-            elif line.startswith("container") and "containerEngine" in line:
-                # Next two lines are singularity and docker
-                read_container = 1
-            elif line.startswith("container"):
-                # There is not singularity image
-                envs["singularity"] = False
-                envs["docker"] = line.replace("container ", "").replace("'", "")
-            elif read_container == 1:
-                # Galaxy Project image
-                envs["singularity"] = line.replace("'", "").split(" ")[0].strip()
-                read_container = 2
-            elif read_container == 2:
-                # Biocontainer
-                envs["docker"] = line.replace("'", "").replace('}"', "").strip()
-                read_container = 0
+    main = Path(main_nf).read_text()
+    if "conda_tools" not in main and "container" not in main:
+        # Nothing to build for this module
+        return envs
+
+    conda = CONDA_TOOLS.search(main)
+    if conda:
+        envs["conda"] = conda.group(1)
+
+    containers = CONTAINER_ENGINE.search(main)
+    if containers:
+        # Galaxy Project image and Biocontainer
+        envs["singularity"], envs["docker"] = containers.groups()
+    else:
+        container = CONTAINER.search(main)
+        if container:
+            # There is not singularity image
+            envs["singularity"] = False
+            envs["docker"] = container.group(1)
     return envs
 
 
-def parse_workflows(bactopia_path, include_merlin=False, build_all=False):
-    """Parse Bactopia's workflows.conf to get modules per-workflow"""
+def parse_workflows(
+    bactopia_path, include_merlin=False, build_all=False, target_workflows=None
+):
+    """Parse Bactopia's workflows.conf to get modules per-workflow
+
+    Returns the modules used by each workflow, and the environment info for each module.
+    Only modules of the target workflows are parsed, or all of them if not given.
+    """
     workflows = {}
     available_workflows = []
-    nf_config, stderr = execute(
-        f"nextflow config -flat {bactopia_path}/main.nf", capture=True
-    )
-    for line in nf_config.split("\n"):
-        if line.startswith("params.available_workflows.") or line.startswith(
-            "params.workflows."
-        ):
-            param, val = line.split(" = ")
-            if line.startswith("params.available_workflows."):
-                # Available workflow definitions
-                for wf in cleanup_value(val):
-                    available_workflows.append(wf)
-            elif line.startswith("params.workflows."):
-                # Workflow definitions
-                wf, key = param.replace("params.workflows.", "").split(".")
-                if wf not in workflows:
-                    workflows[wf] = {}
-                workflows[wf][key] = cleanup_value(val)
-
-    # Merged the two
+    nf_config = get_nextflow_config(bactopia_path, BACTOPIA_CACHEDIR)
+    for kind, param, val in WORKFLOW_PARAM.findall(nf_config):
+        if kind == "available_workflows":
+            # Available workflow definitions
+            for wf in cleanup_value(val):
+                available_workflows.append(wf)
+        else:
+            # Workflow definitions
+            wf, key = param.split(".")
+            if wf not in workflows:
+                workflows[wf] = {}
+            workflows[wf][key] = cleanup_value(val)
+
+    # Merged the two, each workflow only lists its modules since most are shared
     final_workflows = {}
     for wf in available_workflows:
-        final_workflows[wf] = {}
-        modules = {}
+        modules = set()
         if "includes" in workflows[wf]:
             for include in workflows[wf]["includes"]:
                 if "modules" in workflows[include]:
                     for module in workflows[include]["modules"]:
-                        modules[module] = True
+                        modules.add(module)
         if "modules" in workflows[wf]:
             for module in workflows[wf]["modules"]:
-                modules[module] = True
+                modules.add(module)
         if "path" in workflows[wf]:
-            modules[wf] = True
+            modules.add(wf)
 
         if wf == "bactopia" or wf == "staphopia":
             # Build Prokka and Bakta
-            modules["prokka"] = True
+            modules.add("prokka")
             for module in workflows["bakta"]["modules"]:
-                modules[module] = True
+                modules.add(module)
             # Install Merlin tools
             if include_merlin:
                 for module in workflows["merlin"]["modules"]:
-                    modules[module] = True
+                    modules.add(module)
 
-        for module in modules:
-            final_workflows[wf][module] = parse_module(
-                f'{bactopia_path}/{workflows[module]["path"]}/main.nf'
-            )
+        modules.add("custom_dumpsoftwareversions")
+        modules.add("csvtk_concat")
+        final_workflows[wf] = sorted(modules)
 
-        final_workflows[wf]["custom_dumpsoftwareversions"] = parse_module(
-            f'{bactopia_path}/{workflows["custom_dumpsoftwareversions"]["path"]}/main.nf'
-        )
-        final_workflows[wf]["csvtk_concat"] = parse_module(
-            f'{bactopia_path}/{workflows["csvtk_concat"]["path"]}/main.nf'
-        )
+    # Parse each module once
+    module_envs = {}
+    for wf, modules in final_workflows.items():
+        if target_workflows and wf not in target_workflows:
+            continue
+        for module in modules:
+            if module not in module_envs:
+                module_envs[module] = parse_module(
+                    f'{bactopia_path}/{workflows[module]["path"]}/main.nf'
+                )
 
-    return final_workflows
+    return final_workflows, module_envs
 
 
 def build_env(
@@ -199,105 +273,119 @@ def build_env(
     # Conda
     # ISMapper is a special case, must always use conda
     conda_method = "conda" if envname == "ismapper" else conda_method
-    conda_envname = (
-        envinfo["conda"].replace("=", "-").replace(":", "-").replace(" ", "-")
-    )
+    conda_envname = envinfo["conda"].translate(CONDA_NAME)
     conda_prefix = f"{conda_path}/{conda_envname}"
 
     singularity_name = None
     if use_build:
-        singularity_name = envinfo["docker"].replace(":", "-").replace("/", "-")
+        singularity_name = envinfo["docker"].translate(IMAGE_NAME)
     elif not envinfo["singularity"]:
-        singularity_name = envinfo["docker"].replace(":", "-").replace("/", "-")
+        singularity_name = envinfo["docker"].translate(IMAGE_NAME)
         use_build = True
     else:
         singularity_name = (
-            envinfo["singularity"]
-            .replace("https://", "")
-            .replace(":", "-")
-            .replace("/", "-")
+            envinfo["singularity"].replace("https://", "").translate(IMAGE_NAME)
         )
 
     # Check for completion files
     singularity_img = f"{singularity_path}/{singularity_name}.img"
     conda_complete = f"{conda_path}/{conda_envname}/env-built.txt"
 
-    # Check if Conda build is needed
-    if build_conda and Path(conda_complete).exists():
-        if conda_prefix in BUILT_ALREADY["conda"]:
-            logging.debug(BUILT_ALREADY["conda"][conda_prefix])
-            build_conda = False
-        elif force:
-            logging.debug(f"Overwriting existing Conda environment in {conda_prefix}")
-        else:
-            logging.debug(
-                f"Found Conda environment in {conda_prefix}, if a complete rebuild is needed please use --force_rebuild"
-            )
-            build_conda = False
-
-    # Check if Docker build is needed
-    if build_docker and not needs_docker_pull(envinfo["docker"]):
-        if not force:
-            logging.debug(
-                f"Found Docker container for {envinfo['docker']}, if a complete rebuild is needed please manually remove the containers"
-            )
-            build_docker = False
-
-    # Check if Singularity build is needed
-    if build_singularity and Path(singularity_img).exists():
-        if singularity_img in BUILT_ALREADY["singularity"]:
-            logging.debug(BUILT_ALREADY["singularity"][singularity_img])
-            build_singularity = False
-        elif force:
-            logging.debug(f"Overwriting existing Singularity image {singularity_img}")
-        else:
-            logging.debug(
-                f"Found Singularity image {singularity_img}, if a complete rebuild is needed please use --force_rebuild"
-            )
-            build_singularity = False
-
+    # Modules may share environments and are built in parallel, so hold a lock on
+    # each environment while checking and building it. Only one Conda environment
+    # is built at a time.
     if build_conda:
-        # Build necessary Conda environments
-        logging.info(f"Begin {envname} create to {conda_prefix}")
-        build_conda_env(
-            conda_method, envinfo["conda"], conda_prefix, max_retry=max_retry
-        )
-        execute(f"date > {conda_complete}")
-        BUILT_ALREADY["conda"][
-            conda_prefix
-        ] = f"Already built {envname} ({conda_prefix}) this run, skipping rebuild"
+        with CONDA_LOCK:
+            # Check if Conda build is needed
+            if path_exists(conda_complete):
+                if ("conda", conda_prefix) in BUILT_ALREADY:
+                    logging.debug(
+                        f"Already built {envname} ({conda_prefix}) this run, skipping rebuild"
+                    )
+                    build_conda = False
+                elif force:
+                    logging.debug(
+                        f"Overwriting existing Conda environment in {conda_prefix}"
+                    )
+                else:
+                    logging.debug(
+                        f"Found Conda environment in {conda_prefix}, if a complete rebuild is needed please use --force_rebuild"
+                    )
+                    build_conda = False
+
+            if build_conda:
+                # Build necessary Conda environments
+                logging.info(f"Begin {envname} create to {conda_prefix}")
+                build_conda_env(
+                    conda_method, envinfo["conda"], conda_prefix, max_retry=max_retry
+                )
+                Path(conda_complete).write_text(
+                    time.strftime("%a %b %d %H:%M:%S %Z %Y\n")
+                )
+                EXISTS_CACHE[conda_complete] = True
+                BUILT_ALREADY.add(("conda", conda_prefix))
 
     if build_docker:
-        # Pull necessary Docker containers
-        if needs_docker_pull(envinfo["docker"]):
-            logging.info(f"Begin docker pull of {envinfo['docker']}")
-            docker_pull(envinfo["docker"], max_retry=max_retry)
+        with build_lock(f"docker://{envinfo['docker']}"):
+            # Check if Docker build is needed
+            if not needs_docker_pull(envinfo["docker"]):
+                if not force:
+                    logging.debug(
+                        f"Found Docker container for {envinfo['docker']}, if a complete rebuild is needed please manually remove the containers"
+                    )
+                    build_docker = False
+
+            if build_docker:
+                # Pull necessary Docker containers
+                if needs_docker_pull(envinfo["docker"]):
+                    logging.info(f"Begin docker pull of {envinfo['docker']}")
+                    docker_pull(envinfo["docker"], max_retry=max_retry)
+                    DOCKER_IMAGES[envinfo["docker"]] = True
 
     if build_singularity:
-        # Build necessary Singularity images
-        if needs_singularity_build(singularity_img, force=force):
-            execute(f"mkdir -p {singularity_path}")
-            if use_build:
-                logging.info(f"Begin {envname} build to {singularity_img}")
-                build_singularity_image(
-                    singularity_img,
-                    f"docker://{envinfo['docker']}",
-                    max_retry=max_retry,
-                    force=force,
-                    use_build=use_build,
-                )
-            else:
-                logging.info(f"Begin {envname} download to {singularity_img}")
-                build_singularity_image(
-                    singularity_img,
-                    envinfo["singularity"],
-                    max_retry=max_retry,
-                    force=force,
-                    use_build=use_build,
-                )
-            BUILT_ALREADY["singularity"][
-                singularity_img
-            ] = f"Already built {envname} ({singularity_img}) this run, skipping rebuild"
+        with build_lock(singularity_img):
+            # Check if Singularity build is needed
+            if path_exists(singularity_img):
+                if ("singularity", singularity_img) in BUILT_ALREADY:
+                    logging.debug(
+                        f"Already built {envname} ({singularity_img}) this run, skipping rebuild"
+                    )
+                    build_singularity = False
+                elif force:
+                    logging.debug(
+                        f"Overwriting existing Singularity image {singularity_img}"
+                    )
+                else:
+                    logging.debug(
+                        f"Found Singularity image {singularity_img}, if a complete rebuild is needed please use --force_rebuild"
+                    )
+                    build_singularity = False
+
+            # Build necessary Singularity images
+            if build_singularity and needs_singularity_build(
+                singularity_img, force=force
+            ):
+                Path(singularity_path).mkdir(parents=True, exist_ok=True)
+                if use_build:
+                    logging.info(f"Begin {envname} build to {singularity_img}")
+                    build_singularity_image(
+                        singularity_img,
+                        f"docker://{envinfo['docker']}",
+                        max_retry=max_retry,
+                        force=force,
+                        use_build=use_build,
+                    )
+                else:
+                    logging.info(f"Begin {envname} download to {singularity_img}")
+                    build_singularity_image(
+                        singularity_img,
+                        envinfo["singularity"],
+                        max_retry=max_retry,
+                        force=force,
+                        use_build=use_build,
+                    )
+                EXISTS_CACHE[singularity_img] = True
+                BUILT_ALREADY.add(("singularity", singularity_img))
 
 
 def check_md5sum(expected_md5, current_md5):
@@ -324,17 +412,58 @@ def needs_conda_create(observed_md5, expected_md5, prefix, force=False):
         else:
             logging.debug(f"Existing env ({prefix}) is out of sync, it will be updated")
             needs_build = True
-    elif prefix in BUILT_ALREADY["conda"]:
-        logging.debug(BUILT_ALREADY["conda"][prefix])
+    elif ("conda", prefix) in BUILT_ALREADY:
+        logging.debug(f"Already built {prefix} this run, skipping rebuild")
     else:
         needs_build = True
     return needs_build
 
 
+def docker_image_exists(pull_name: str) -> Optional[bool]:
+    """
+    Ask the Docker Engine API if an image exists locally
+
+    Args:
+        pull_name (str): The image to check for
+
+    Returns:
+        bool: True if the image exists, False if not, None if the API could not be reached
+    """
+    docker_host = os.getenv("DOCKER_HOST", f"unix://{DOCKER_SOCKET}")
+    if not docker_host.startswith("unix://"):
+        return None
+    socket_path = docker_host.replace("unix://", "", 1)
+    if not os.path.exists(socket_path):
+        return None
+
+    connection = DockerSocketConnection(socket_path)
+    try:
+        connection.request("GET", f"/images/{quote(pull_name, safe='/:@')}/json")
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        return None
+    finally:
+        connection.close()
+
+    if status == 200:
+        return True
+    elif status == 404:
+        return False
+    return None
+
+
 def needs_docker_pull(pull_name):
     """Check if a new container needs to be pulled."""
-    output = execute(f"docker inspect {pull_name} || true", capture=True)
-    if output[1].startswith("Error: No such object"):
+    if pull_name not in DOCKER_IMAGES:
+        # Querying the Docker socket directly avoids starting the docker CLI
+        exists = docker_image_exists(pull_name)
+        if exists is None:
+            output = execute(f"docker inspect {pull_name} || true", capture=True)
+            exists = not output[1].startswith("Error: No such object")
+        DOCKER_IMAGES[pull_name] = exists
+    if not DOCKER_IMAGES[pull_name]:
         return True
     logging.debug(
         f"Existing container ({pull_name}) found, skipping unless manually removed"
@@ -344,84 +473,73 @@ def needs_docker_pull(pull_name):
 
 def needs_singularity_build(image, force=False):
     """Check if a new image needs to be built."""
-    if Path(image).exists() and not force:
+    if path_exists(image) and not force:
         logging.debug(
             f"Existing image ({image}) found, skipping unless --force is used"
         )
         return False
-    elif image in BUILT_ALREADY["singularity"]:
-        logging.debug(BUILT_ALREADY["singularity"][image])
+    elif ("singularity", image) in BUILT_ALREADY:
+        logging.debug(f"Already built {image} this run, skipping rebuild")
         return False
     return True
 
 
-def build_conda_env(
-    program: str, conda_env: str, conda_path: str, max_retry: int = 5
-) -> bool:
-    """Build Conda env, with chance to retry."""
+def retry_execute(cmd: str, error: str, max_retry: int = 5) -> bool:
+    """
+    Run a command, retrying with exponential backoff if it fails
+
+    Args:
+        cmd (str): The command to run
+        error (str): The error to log after each failed attempt
+        max_retry (int, optional): Maximum number of retries, Defaults to 5.
+
+    Returns:
+        bool: True once the command succeeds, exits if the final retry fails
+    """
     retry = 0
     allow_fail = False
     success = False
     while not success:
-        result = execute(
-            f"rm -rf {conda_path} && {program} create -y -p {conda_path} -c conda-forge -c bioconda --force {conda_env}",
-            allow_fail=allow_fail,
-        )
+        result = execute(cmd, allow_fail=allow_fail)
         if not result:
             if retry > max_retry:
                 allow_fail = True
             retry += 1
-            logging.error(
-                "Error creating Conda environment, retrying after short sleep."
-            )
-            time.sleep(10 * retry)
+            logging.error(f"{error}, retrying after short sleep.")
+            # Transient failures retry quickly, persistent ones back off to the cap
+            time.sleep(min(RETRY_MAX_SLEEP, 2**retry) + random.random())
         else:
             success = True
     return success
 
 
+def build_conda_env(
+    program: str, conda_env: str, conda_path: str, max_retry: int = 5
+) -> bool:
+    """Build Conda env, with chance to retry."""
+    return retry_execute(
+        f"rm -rf {conda_path} && {program} create -y -p {conda_path} -c conda-forge -c bioconda --force {conda_env}",
+        "Error creating Conda environment",
+        max_retry=max_retry,
+    )
+
+
 def docker_pull(container, max_retry=5):
     """Pull docker container, with chance to retry."""
-    retry = 0
-    allow_fail = False
-    success = False
-    while not success:
-        result = execute(f"docker pull {container}", allow_fail=allow_fail)
-        if not result:
-            if retry > max_retry:
-                allow_fail = True
-            retry += 1
-            logging.error("Error pulling container, retrying after short sleep.")
-            time.sleep(10 * retry)
-        else:
-            success = True
-    return success
+    return retry_execute(
+        f"docker pull {container}", "Error pulling container", max_retry=max_retry
+    )
 
 
 def build_singularity_image(image, pull, max_retry=5, force=False, use_build=False):
     """Build Conda env, with chance to retry."""
     force = "--force" if force else ""
-    retry = 0
-    allow_fail = False
-    success = False
-    while not success:
-        result = None
-        if use_build:
-            result = execute(
-                f"singularity build {force} {image} {pull}", allow_fail=allow_fail
-            )
-        else:
-            # Download from Galaxy Project
-            result = execute(f"wget --quiet -O {image} {pull}", allow_fail=allow_fail)
-        if not result:
-            if retry > max_retry:
-                allow_fail = True
-            retry += 1
-            logging.error("Error creating image, retrying after short sleep.")
-            time.sleep(10 * retry)
-        else:
-            success = True
-    return success
+    if use_build:
+        cmd = f"singularity build {force} {image} {pull}"
+    else:
+        # Download from Galaxy Project
+        cmd = f"wget --quiet -O {image} {pull}"
+    return retry_execute(cmd, "Error creating image", max_retry=max_retry)
 
 
 @click.command(
@@ -492,6 +610,13 @@ def build_singularity_image(image, pull, max_retry=5, force=False, use_build=Fal
     default=3,
     help="Maximum times to attempt creating Conda environment. (Default: 3)",
 )
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Maximum number of environments to build at the same time",
+)
 @click.option("--verbose", is_flag=True, help="Print debug related text.")
 @click.option("--silent", is_flag=True, help="Only critical errors will be printed.")
 @click.argument("unknown", nargs=-1, type=click.UNPROCESSED)
@@ -507,11 +632,20 @@ def download(
     use_conda,
     force_rebuild,
     max_retry,
+    jobs,
     verbose,
     silent,
     unknown,
 ):
     """Builds Bactopia environments for use with Nextflow."""
+    # Rich tracebacks and logging pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+    from rich.logging import RichHandler
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
+
     # Setup logs
     logging.basicConfig(
         format="%(asctime)s:%(name)s:%(levelname)s - %(message)s",
@@ -532,8 +666,11 @@ def download(
 
     # Current Bactopia workflows
     include_merlin = True if "--ask_merlin" in unknown else False
-    workflow_modules = parse_workflows(
-        bactopia_path, include_merlin=include_merlin, build_all=build_all
+    workflow_modules, module_envs = parse_workflows(
+        bactopia_path,
+        include_merlin=include_merlin,
+        build_all=build_all,
+        target_workflows=None if build_all or build_nfcore else {wf},
     )
 
     if wf not in workflow_modules:
@@ -544,22 +681,43 @@ def download(
     logging.info(
         "Checking if environment pre-builds are needed (this may take a while if building for the first time)"
     )
-    for workflow, modules in workflow_modules.items():
-        if workflow == wf or build_all or build_nfcore:
-            logging.debug(f"Working on {workflow} (--wf)")
-            for module, info in modules.items():
-                logging.debug(f"Building required environment: {module}")
-                build_env(
-                    module,
-                    info,
-                    conda_path,
-                    conda_method,
-                    singularity_path,
-                    envtype,
-                    force=force_rebuild,
-                    max_retry=max_retry,
-                    use_build=singularity_pull_docker_container,
-                )
+    # Builds are mostly waiting on downloads and installs, so run them in parallel
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    builds = []
+    try:
+        # Workflows share most modules, only build each environment once
+        seen = set()
+        for workflow, modules in workflow_modules.items():
+            if workflow == wf or build_all or build_nfcore:
+                logging.debug(f"Working on {workflow} (--wf)")
+                for module in modules:
+                    if module in seen:
+                        continue
+                    seen.add(module)
+                    logging.debug(f"Building required environment: {module}")
+                    builds.append(
+                        executor.submit(
+                            build_env,
+                            module,
+                            module_envs[module],
+                            conda_path,
+                            conda_method,
+                            singularity_path,
+                            envtype,
+                            force=force_rebuild,
+                            max_retry=max_retry,
+                            use_build=singularity_pull_docker_container,
+                        )
+                    )
+
+        # Surface any errors raised while building
+        for build in as_completed(builds):
+            build.result()
+    finally:
+        # If a build fails, exit without starting the ones still queued
+        for build in builds:
+            build.cancel()
+        executor.shutdown(wait=False)
 
 
 def main():
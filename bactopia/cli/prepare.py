@@ -1,4 +1,6 @@
+import csv
 import logging
+import os
 import re
 import sys
 import textwrap
@@ -6,16 +8,12 @@ from pathlib import Path
 
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-from rich.logging import RichHandler
 
 import bactopia
 from bactopia.utils import get_ncbi_genome_size, get_taxid_from_species, validate_file
 
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.OPTION_GROUPS = {
     "bactopia-prepare": [
@@ -58,6 +56,9 @@ click.rich_click.OPTION_GROUPS = {
     ]
 }
 
+# Positions of each file type in a sample's files
+R1, R2, SE, ASSEMBLY = range(4)
+
 
 def read_metadata(metadata: str) -> dict:
     """
@@ -70,11 +71,11 @@ def read_metadata(metadata: str) -> dict:
         dict: A dictionary of metadata, associating genome size and species to a samples
     """
     metadata_dict = {}
-    with open(metadata, "r") as fh:
-        for line in fh:
-            # Use replace, since final column may be empty
-            if line:
-                sample, species, gsize = line.rstrip().split("\t")
+    with open(metadata, "r", newline="") as fh:
+        for row in csv.reader(fh, delimiter="\t", quoting=csv.QUOTE_NONE):
+            # Final column may be empty, csv keeps it rather than stripping it
+            if row:
+                sample, species, gsize = row
                 if not gsize:
                     gsize = 0
                 if not species:
@@ -83,14 +84,13 @@ def read_metadata(metadata: str) -> dict:
     return metadata_dict
 
 
-def get_genome_size(
-    genome_sizes: dict, genome_size: int, species: str, taxid: str
-) -> int:
+def get_genome_size(genome_size: int, species: str, taxid: str) -> int:
     """
     Determine which value to use for genome size
 
+    NCBI's genome sizes are only downloaded if a taxon ID or species is needed.
+
     Args:
-        genome_sizes (dict): A dictionary of genome sizes from NCBI
         genome_size (int): The genome size provided by the user
         species (str): The species provided by the user
         taxid (str): The taxon ID provided by the user
@@ -101,6 +101,7 @@ def get_genome_size(
 
     if taxid:
         # Use the taxon ID to get the genome size
+        genome_sizes = get_ncbi_genome_size()
         return [genome_sizes[taxid]["expected_ungapped_length"], taxid]
     elif genome_size > 0:
         # User provided genome size
@@ -108,23 +109,44 @@ def get_genome_size(
     elif species and species != "UNKNOWN_SPECIES":
         # Get genome size from NCBI based on species
         taxid = get_taxid_from_species(species)
+        genome_sizes = get_ncbi_genome_size()
         return [genome_sizes[taxid]["expected_ungapped_length"], taxid]
     else:
         # No genome size provided, not ideal
         return [0, None]
 
 
-def search_path(path, pattern, recursive=False):
-    if recursive:
-        return Path(path).rglob(pattern)
-    else:
-        return Path(path).glob(pattern)
+def scan_path(path: str, recursive: bool = False) -> os.DirEntry:
+    """
+    Yield every entry in a directory, listing each directory only once
+
+    Entries are yielded in the same order as Path.glob/rglob, files in a directory
+    before those in its subdirectories, and symlinked directories are not followed.
 
+    Args:
+        path (str): The directory to search
+        recursive (bool): Search subdirectories as well
 
-def get_path(fastq, abspath, prefix):
-    fastq_path = str(fastq.absolute())
+    Returns:
+        os.DirEntry: Each entry found
+    """
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                yield entry
+                if recursive and entry.is_dir() and not entry.is_symlink():
+                    subdirs.append(entry.path)
+    except OSError:
+        # Match glob, which skips directories it can't read
+        return
+    for subdir in subdirs:
+        yield from scan_path(subdir, recursive=True)
+
+
+def get_path(fastq_path: str, abspath: str, prefix: str) -> str:
     if prefix:
-        return fastq_path.replace(str(abspath), prefix).replace("///", "//")
+        return fastq_path.replace(abspath, prefix).replace("///", "//")
     return fastq_path
 
 
@@ -297,6 +319,14 @@ def prepare(
     silent,
 ):
     """Create a 'file of filenames' (FOFN) of samples to be processed by Bactopia"""
+    # Rich tracebacks and logging pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+    from rich.logging import RichHandler
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
+
     # Setup logs
     logging.basicConfig(
         format="%(asctime)s:%(name)s:%(levelname)s - %(message)s",
@@ -315,102 +345,101 @@ def prepare(
         )
         sys.exit(1)
 
-    abspath = Path(path).absolute()
+    abspath = str(Path(path).absolute())
+    # Each sample has lists of R1, R2, single-end reads and assemblies
     SAMPLES = {}
     SPECIES_TAXIDS = {}
+    GENOME_SIZES = {}
 
-    # Get genome sizes
-    genome_sizes = get_ncbi_genome_size()
     metadata_info = None
     if metadata:
         metadata_info = read_metadata(validate_file(metadata))
 
-    genome_size, species_taxid = get_genome_size(
-        genome_sizes, genome_size, species, taxid
-    )
+    genome_size, species_taxid = get_genome_size(genome_size, species, taxid)
     if species_taxid:
         SPECIES_TAXIDS[species] = species_taxid
 
-    # Match FASTQS
-    for fastq in search_path(abspath, f"*{fastq_ext}", recursive=recursive):
-        fastq_name = fastq.name.replace(fastq_ext, "")
-        # Split the fastq file name on separator
-        # Example MY_FASTQ_R1.rsplit('_', 1) becomes ['MY_FASTQ', 'R1'] (PE)
-        # Example MY_FASTQ.rsplit('_', 1) becomes ['MY_FASTQ'] (SE)
-        split_vals = fastq_name.rsplit(fastq_separator, 1)
-        sample_name = split_vals[0]
-        if sample_name not in SAMPLES:
-            SAMPLES[sample_name] = {
-                "pe": {"r1": [], "r2": []},
-                "se": [],
-                "assembly": [],
-            }
-
-        if len(split_vals) == 1:
-            # single-end
-            SAMPLES[sample_name]["se"].append(get_path(fastq, abspath, prefix))
-        else:
-            # paired-end
-            pe1 = re.compile(pe1_pattern)
-            pe2 = re.compile(pe2_pattern)
-            if pe1.match(split_vals[1]):
-                SAMPLES[sample_name]["pe"]["r1"].append(
-                    get_path(fastq, abspath, prefix)
-                )
-            elif pe2.match(split_vals[1]):
-                SAMPLES[sample_name]["pe"]["r2"].append(
-                    get_path(fastq, abspath, prefix)
-                )
+    # Match FASTQs and assemblies in a single pass over the directory
+    pe1 = re.compile(pe1_pattern)
+    pe2 = re.compile(pe2_pattern)
+    # Only a handful of read set names (e.g. R1, R2) are expected, so each is only
+    # matched against the patterns the first time it is seen
+    read_sets = {}
+    for entry in scan_path(abspath, recursive=recursive):
+        if entry.name.endswith(fastq_ext):
+            fastq_name = entry.name[: len(entry.name) - len(fastq_ext)]
+            # Split the fastq file name on separator
+            # Example MY_FASTQ_R1.rsplit('_', 1) becomes ['MY_FASTQ', 'R1'] (PE)
+            # Example MY_FASTQ.rsplit('_', 1) becomes ['MY_FASTQ'] (SE)
+            split_vals = fastq_name.rsplit(fastq_separator, 1)
+            sample_name = split_vals[0]
+            sample_files = SAMPLES.get(sample_name)
+            if sample_files is None:
+                sample_files = SAMPLES[sample_name] = [[], [], [], []]
+
+            if len(split_vals) == 1:
+                # single-end
+                sample_files[SE].append(get_path(entry.path, abspath, prefix))
             else:
-                logging.error(
-                    f'ERROR: Could not determine read set for "{fastq_name}".'
-                )
-                logging.error(
-                    f"ERROR: Found {split_vals[1]} expected (R1: {pe1_pattern} or R2: {pe2_pattern})"
-                )
-                logging.error(
-                    "ERROR: Please use --pe1-pattern and --pe2-pattern to correct and try again."
-                )
-                sys.exit(1)
-
-    # Match assemblies
-    for assembly in search_path(abspath, f"*{assembly_ext}", recursive=recursive):
-        sample_name = Path(assembly).name.replace(assembly_ext, "")
-        if sample_name not in SAMPLES:
-            SAMPLES[sample_name] = {
-                "pe": {"r1": [], "r2": []},
-                "se": [],
-                "assembly": [],
-            }
-        SAMPLES[sample_name]["assembly"].append(get_path(assembly, abspath, prefix))
+                # paired-end
+                read_set = read_sets.get(split_vals[1])
+                if read_set is None:
+                    if pe1.match(split_vals[1]):
+                        read_set = R1
+                    elif pe2.match(split_vals[1]):
+                        read_set = R2
+                    read_sets[split_vals[1]] = read_set
+
+                if read_set is not None:
+                    sample_files[read_set].append(get_path(entry.path, abspath, prefix))
+                else:
+                    logging.error(
+                        f'ERROR: Could not determine read set for "{fastq_name}".'
+                    )
+                    logging.error(
+                        f"ERROR: Found {split_vals[1]} expected (R1: {pe1_pattern} or R2: {pe2_pattern})"
+                    )
+                    logging.error(
+                        "ERROR: Please use --pe1-pattern and --pe2-pattern to correct and try again."
+                    )
+                    sys.exit(1)
 
+        if entry.name.endswith(assembly_ext):
+            sample_name = entry.name[: len(entry.name) - len(assembly_ext)]
+            sample_files = SAMPLES.get(sample_name)
+            if sample_files is None:
+                sample_files = SAMPLES[sample_name] = [[], [], [], []]
+            sample_files[ASSEMBLY].append(get_path(entry.path, abspath, prefix))
+
+    # Rows are only written once every sample is resolved, NCBI lookups may exit early
     FOFN = []
-    for sample, vals in sorted(SAMPLES.items()):
-        r1_reads = vals["pe"]["r1"]
-        r2_reads = vals["pe"]["r2"]
-        se_reads = vals["se"]
-        assembly = vals["assembly"]
+    for sample in sorted(SAMPLES):
+        r1_reads, r2_reads, se_reads, assembly = SAMPLES[sample]
         errors = []
         is_single_end = False
         multiple_read_sets = False
-        pe_count = len(r1_reads) + len(r2_reads)
+        r1_count = len(r1_reads)
+        r2_count = len(r2_reads)
+        se_count = len(se_reads)
+        assembly_count = len(assembly)
+        pe_count = r1_count + r2_count
 
         # Validate everything
-        if len(assembly) > 1:
+        if assembly_count > 1:
             # Can't have multiple assemblies for the same sample
             errors.append(
                 f'"{sample}" cannot have more than two assembly FASTA, please check.'
             )
-        elif len(assembly) == 1 and (pe_count or len(se_reads)):
+        elif assembly_count == 1 and (pe_count or se_count):
             # Can't have an assembly and reads for a sample
             errors.append(
                 f'"{sample}" cannot have assembly and sequence reads, please check.'
             )
 
-        if len(r1_reads) != len(r2_reads):
+        if r1_count != r2_count:
             # PE reads must be a pair
             errors.append(
-                f'"{sample}" must have equal paired-end read sets (R1 has {len(r1_reads)} and R2 has {len(r2_reads)}, please check.'
+                f'"{sample}" must have equal paired-end read sets (R1 has {r1_count} and R2 has {r2_count}, please check.'
             )
         elif pe_count > 2:
             # PE reads must be a pair
@@ -422,14 +451,14 @@ def prepare(
                 )
 
         if ont:
-            if not pe_count and len(se_reads):
+            if not pe_count and se_count:
                 is_single_end = True
-            elif pe_count and len(se_reads) and not hybrid and not short_polish:
+            elif pe_count and se_count and not hybrid and not short_polish:
                 errors.append(
                     f'"{sample}" cannot have paired and single-end FASTQs, please check. Did you mean to use "--hybrid" or "--short-polish"?'
                 )
         else:
-            if len(se_reads) > 1:
+            if se_count > 1:
                 # Can't have multiple SE reads
                 if merge:
                     multiple_read_sets = True
@@ -437,7 +466,7 @@ def prepare(
                     errors.append(
                         f'"{sample}" has more than two single-end FASTQs, please check. Did you mean to use "--merge"?'
                     )
-            elif pe_count and len(se_reads):
+            elif pe_count and se_count:
                 # Can't have SE and PE reads unless long reads
                 errors.append(
                     f'"{sample}" has paired and single-end FASTQs, please check. Did you mean to use "--ont" along with "--hybrid" or "--short-polish"?'
@@ -500,21 +529,24 @@ def prepare(
                         if sample_species in SPECIES_TAXIDS
                         else None
                     )
-                    sample_gsize, species_taxid = get_genome_size(
-                        genome_sizes, meta_gsize, sample_species, sample_taxid
-                    )
+                    # Samples often share a species, only determine its size once
+                    key = (meta_gsize, sample_species, sample_taxid)
+                    if key not in GENOME_SIZES:
+                        GENOME_SIZES[key] = get_genome_size(*key)
+                    sample_gsize, species_taxid = GENOME_SIZES[key]
                     if species_taxid:
                         # Save the taxid for the species, to prevent repeated lookups
                         SPECIES_TAXIDS[sample_species] = species_taxid
 
             FOFN.append(
-                [sample, runtype, str(sample_gsize), sample_species, r1, r2, extra]
+                "\t".join(
+                    [sample, runtype, str(sample_gsize), sample_species, r1, r2, extra]
+                )
             )
 
     if FOFN:
-        print("sample\truntype\tgenome_size\tspecies\tr1\tr2\textra")
-        for line in FOFN:
-            print("\t".join(line))
+        sys.stdout.write("sample\truntype\tgenome_size\tspecies\tr1\tr2\textra\n")
+        sys.stdout.write("\n".join(FOFN) + "\n")
     else:
         logging.error(
             f"Unable to find any samples in {path}. Please try adjusting the following parameters to fit your needs."
@@ -1,15 +1,16 @@
 import logging
+import os
 import sys
 import textwrap
+import time
 from collections import defaultdict
 from pathlib import Path
 
 import pandas as pd
 import rich
 import rich.console
-import rich.traceback
 import rich_click as click
-from rich.logging import RichHandler
+from tqdm.contrib.concurrent import process_map
 
 import bactopia
 import bactopia.parsers as parsers
@@ -18,10 +19,9 @@ from bactopia.parsers.error import parse_errors
 from bactopia.parsers.parsables import EXCLUDE_COLUMNS, get_parsable_files
 from bactopia.parsers.versions import parse_versions
 from bactopia.summary import get_rank, print_cutoffs, print_failed
+from bactopia.utils import read_cache, write_cache
 
 # Set up Rich
-stderr = rich.console.Console(stderr=True)
-rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
 click.rich_click.USE_RICH_MARKUP = True
 click.rich_click.OPTION_GROUPS = {
     "bactopia-summary": [
@@ -60,7 +60,9 @@ click.rich_click.OPTION_GROUPS = {
             "options": [
                 "--outdir",
                 "--prefix",
+                "--cpus",
                 "--force",
+                "--no-cache",
                 "--verbose",
                 "--silent",
                 "--version",
@@ -72,6 +74,8 @@ click.rich_click.OPTION_GROUPS = {
 COUNTS = defaultdict(int)
 FAILED = defaultdict(list)
 CATEGORIES = defaultdict(list)
+# Bump when the parsed results change shape, old caches are then ignored
+RESULTS_CACHE_VERSION = f"{bactopia.__version__}-2"
 
 
 def increment_and_append(key: str, name: str) -> None:
@@ -141,6 +145,83 @@ def process_sample(df: pd.DataFrame, rank_cutoff: dict) -> list:
     return [rank, reason]
 
 
+def parse_sample(parsable_files: dict, name: str) -> pd.DataFrame:
+    """
+    Parse the results of a sample into a single row.
+
+    Args:
+        parsable_files (dict): paths to parse and the parser to use for each
+        name (str): the name of the sample
+
+    Returns:
+        pd.DataFrame: the merged results of each parser
+    """
+    df = pd.DataFrame()
+    for path, parser in parsable_files.items():
+        if Path(path).exists() or parser == "qc":
+            logging.debug(f"\tParsing {path} ({parser})")
+            if df.empty:
+                df = pd.DataFrame([getattr(parsers, parser).parse(path, name)])
+            else:
+                df = pd.merge(
+                    df,
+                    pd.DataFrame([getattr(parsers, parser).parse(path, name)]),
+                    on="sample",
+                    how="inner",
+                )
+    return df
+
+
+def read_cached_results(cache: str) -> tuple:
+    """
+    Read the parsed results saved by a previous run.
+
+    Args:
+        cache (str): path to the cached results of a previous run
+
+    Returns:
+        tuple: absolute sample paths mapped to their files and parsed results, and the
+            time the samples were indexed (empty and 0 if there was no usable cache)
+    """
+    cached = read_cache(cache)
+    if cached is None:
+        return {}, 0
+    elif not isinstance(cached, dict) or cached.get("version") != RESULTS_CACHE_VERSION:
+        logging.debug(f"Ignoring cached results from another version: {cache}")
+        return {}, 0
+    return cached["results"], cached["indexed"]
+
+
+def list_sample_files(files: dict) -> frozenset:
+    """
+    Flatten the index of a sample directory into its set of file paths.
+
+    Args:
+        files (dict): file names and paths found in the sample directory
+
+    Returns:
+        frozenset: every file path found in the sample directory
+    """
+    return frozenset(str(path) for paths in files.values() for path in paths)
+
+
+def is_unchanged(files: frozenset, cached_files: frozenset, mtime: float) -> bool:
+    """
+    Check if a sample directory has the same files as before, all older than a given time.
+
+    Args:
+        files (frozenset): file paths found in the sample directory
+        cached_files (frozenset): file paths found when the results were cached
+        mtime (float): the time the sample directory was previously indexed
+
+    Returns:
+        bool: True if no file has been added, removed or modified since, False otherwise
+    """
+    return files == cached_files and all(
+        os.stat(path, follow_symlinks=False).st_mtime < mtime for path in files
+    )
+
+
 @click.command()
 @click.version_option(bactopia.__version__, "--version", "-V")
 @click.option(
@@ -270,7 +351,19 @@ def process_sample(df: pd.DataFrame, rank_cutoff: dict) -> list:
     show_default=True,
     help="Prefix to use for output files",
 )
+@click.option(
+    "--cpus",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="The total number of cpus to use for parsing results",
+)
 @click.option("--force", is_flag=True, help="Overwrite existing reports")
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Parse every sample, ignoring results cached by a previous run",
+)
 @click.option("--verbose", is_flag=True, help="Increase the verbosity of output")
 @click.option("--silent", is_flag=True, help="Only critical errors will be printed")
 def summary(
@@ -291,11 +384,21 @@ def summary(
     max_assembled_size,
     outdir,
     prefix,
+    cpus,
     force,
+    no_cache,
     verbose,
     silent,
 ):
     """Generate a summary table from the Bactopia results."""
+    # Rich tracebacks and logging pull in pygments, so only load them once the
+    # command actually runs (not for --help or --version)
+    import rich.traceback
+    from rich.logging import RichHandler
+
+    stderr = rich.console.Console(stderr=True)
+    rich.traceback.install(console=stderr, width=200, word_wrap=True, extra_lines=1)
+
     # Setup logs
     logging.basicConfig(
         format="%(asctime)s:%(name)s:%(levelname)s - %(message)s",
@@ -336,6 +439,7 @@ def summary(
     txt_report = f"{outdir}/{prefix}-report.tsv".replace("//", "/")
     exclusion_report = f"{outdir}/{prefix}-exclude.tsv".replace("//", "/")
     summary_report = f"{outdir}/{prefix}-summary.txt".replace("//", "/")
+    results_cache = f"{outdir}/.{prefix}-results.pkl".replace("//", "/")
 
     if Path(txt_report).exists() and not force:
         logging.error(f"Report already exists! Use --force to overwrite: {txt_report}")
@@ -344,10 +448,25 @@ def summary(
         logging.debug(f"Creating output directory: {outdir}")
         Path(outdir).mkdir(parents=True, exist_ok=True)
 
+    # Reuse parsed results of samples that are unchanged since the previous run
+    cached_results, cache_mtime = {}, 0
+    if no_cache:
+        logging.debug(f"Provided --no-cache, ignoring cached results: {results_cache}")
+    else:
+        cached_results, cache_mtime = read_cached_results(results_cache)
+        logging.debug(f"Found {len(cached_results)} cached samples in {results_cache}")
+    sample_paths = {}
+    sample_file_sets = {}
+
+    complete_samples = []
+    needs_parsing = {}
+    parsed_results = {}
     processed_samples = {}
     versions = []
     dfs = []
-    samples = parse_bactopia_directory(bactopia_path)
+    # Files modified while indexing must not be seen as unchanged by the next run
+    indexed = time.time()
+    samples = parse_bactopia_directory(bactopia_path, max_workers=cpus)
     logging.info(f"Found {len(samples)} samples in {bactopia_path} to process")
     if samples:
         for sample in samples:
@@ -355,54 +474,39 @@ def summary(
                 COUNTS["total"] += 1
                 logging.debug(f"Processing {sample['id']} ({sample['path']})")
 
+                sample_files = sample["files"]
+
                 # Get the versions files to parse
                 versions += parse_versions(
-                    [file for file in sample["path"].rglob("versions.yml")],
+                    sample_files.get("versions.yml", []),
                     sample["id"],
                 )
 
                 # Check if has errors
-                errors = parse_errors(sample["path"], sample["id"])
+                errors = parse_errors(sample_files, sample["id"])
                 if errors:
                     # Sample has errors, skip parsing
                     process_errors(sample["id"], errors)
                 else:
                     # Get list of files to parse
-                    df = pd.DataFrame()
                     is_complete, parsable_files = get_parsable_files(
-                        sample["path"], sample["id"]
+                        sample["path"], sample["id"], sample_files
                     )
                     if is_complete:
-                        for path, parser in parsable_files.items():
-                            if Path(path).exists() or parser == "qc":
-                                logging.debug(f"\tParsing {path} ({parser})")
-                                if df.empty:
-                                    df = pd.DataFrame(
-                                        [
-                                            getattr(parsers, parser).parse(
-                                                path, sample["id"]
-                                            )
-                                        ]
-                                    )
-                                else:
-                                    df = pd.merge(
-                                        df,
-                                        pd.DataFrame(
-                                            [
-                                                getattr(parsers, parser).parse(
-                                                    path, sample["id"]
-                                                )
-                                            ]
-                                        ),
-                                        on="sample",
-                                        how="inner",
-                                    )
-                        rank, reason = process_sample(df, RANK_CUTOFF)
-                        processed_samples[sample["id"]] = True
-                        df["rank"] = rank
-                        df["reason"] = reason
-                        dfs.append(df)
-                        logging.debug(f"\tRank: {rank} ({reason})")
+                        complete_samples.append(sample["id"])
+                        # Cached by path, samples of other runs may share a name
+                        sample_path = str(sample["path"])
+                        file_set = list_sample_files(sample_files)
+                        sample_paths[sample["id"]] = sample_path
+                        sample_file_sets[sample["id"]] = file_set
+                        cached = cached_results.get(sample_path)
+                        if cached and is_unchanged(
+                            file_set, cached["files"], cache_mtime
+                        ):
+                            logging.debug(f"\tReusing results from {results_cache}")
+                            parsed_results[sample["id"]] = cached["results"]
+                        else:
+                            needs_parsing[sample["id"]] = parsable_files
                     else:
                         logging.info(
                             f"Skipping {sample['id']} ({sample['path']}) due to missing files. Missing:"
@@ -415,6 +519,47 @@ def summary(
                     f"Skipping {sample['id']} ({sample['path']}), incomplete or not a Bactopia directory"
                 )
                 increment_and_append("ignore-unknown", sample["id"])
+
+    # Parsing is independent per sample, so spread it across processes
+    if needs_parsing:
+        logging.info(f"Parsing results of {len(needs_parsing)} samples")
+        parsed_dfs = process_map(
+            parse_sample,
+            needs_parsing.values(),
+            needs_parsing.keys(),
+            max_workers=cpus,
+            chunksize=max(1, len(needs_parsing) // (cpus * 4)),
+            bar_format="{l_bar}{bar:80}{r_bar}{bar:-80b}",
+            desc="Parsing",
+            disable=silent,
+        )
+        parsed_results.update(zip(needs_parsing.keys(), parsed_dfs))
+
+    if parsed_results:
+        write_cache(
+            results_cache,
+            {
+                "version": RESULTS_CACHE_VERSION,
+                "indexed": indexed,
+                "results": {
+                    sample_paths[name]: {
+                        "files": sample_file_sets[name],
+                        "results": df,
+                    }
+                    for name, df in parsed_results.items()
+                },
+            },
+        )
+
+    for name in complete_samples:
+        df = parsed_results[name].copy()
+        rank, reason = process_sample(df, RANK_CUTOFF)
+        processed_samples[name] = True
+        df["rank"] = rank
+        df["reason"] = reason
+        dfs.append(df)
+        logging.debug(f"{name} Rank: {rank} ({reason})")
+
     if dfs:
         final_df = pd.concat(dfs)
         for col in EXCLUDE_COLUMNS:
@@ -3,6 +3,9 @@ Bactopia's parser entry-point.
 
 Example: bactopia.parse(result_type, filename)
 """
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 IGNORE_LIST = [
@@ -14,12 +17,13 @@ IGNORE_LIST = [
 ]
 
 
-def parse_bactopia_directory(path: str) -> list:
+def parse_bactopia_directory(path: str, max_workers: int = None) -> list:
     """
     Scan a Bactopia directory and return parsed results.
 
     Args:
         path (str):  a path to expected Bactopia results
+        max_workers (int, optional): threads used to index sample directories. Defaults to None.
 
     Returns:
         list: Parsed results for all samples in a Bactopia directory
@@ -35,9 +39,21 @@ def parse_bactopia_directory(path: str) -> list:
                         "is_bactopia": _is_bactopia_dir(
                             directory.absolute(), directory.name
                         ),
+                        "files": {},
                     }
                 )
 
+    # Directory walks are I/O bound, so index the samples concurrently
+    bactopia_samples = [result for result in results if result["is_bactopia"]]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        indexes = list(
+            executor.map(
+                index_sample_files, [sample["path"] for sample in bactopia_samples]
+            )
+        )
+    for sample, files in zip(bactopia_samples, indexes):
+        sample["files"] = files
+
     return results
 
 
@@ -53,3 +69,25 @@ def _is_bactopia_dir(path: str, name: str) -> bool:
         bool: path looks like Bactopia (True) or not (False)
     """
     return Path(f"{path}/main/gather/{name}-meta.tsv").exists()
+
+
+def index_sample_files(path: str) -> dict:
+    """
+    Walk a sample directory once and index each file by its name.
+
+    Args:
+        path (str): a path to expected Bactopia results
+
+    Returns:
+        dict: file names as keys and a list of full paths as values
+    """
+    index = defaultdict(list)
+    directories = [str(path)]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    index[entry.name].append(entry.path)
+    return dict(index)
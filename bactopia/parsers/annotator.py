@@ -1,6 +1,8 @@
 """
 Parsers for Annotation related results.
 """
+import re
+
 BAKTA_METADATA = [
     "tRNAs",
     "tmRNAs",
@@ -23,6 +25,8 @@ PROKKA_METADATA = [
     "rRNA",
     "tRNA",
 ]
+# Matches "key: count" lines (e.g. "CDS: 2614")
+ANNOTATION_COUNT = re.compile(r"^([^:\n]+):[ \t]*([0-9]+)[ \t]*$", re.MULTILINE)
 
 
 def parse(path: str, name: str) -> dict:
@@ -55,10 +59,7 @@ def _parse_annotation(path: str, name: str) -> dict:
         "sample": name,
     }
     with open(path, "rt") as fh:
-        for line in fh:
-            line = line.rstrip()
-            if ":" in line:
-                key, val = line.split(":")
-                if key in COLS:
-                    results[f"annotator_total_{key}"] = int(val.lstrip())
+        for key, val in ANNOTATION_COUNT.findall(fh.read()):
+            if key in COLS:
+                results[f"annotator_total_{key}"] = int(val)
     return results
@@ -12,20 +12,22 @@ ERROR_TYPES = {
 }
 
 
-def parse_errors(path: str, name: str) -> dict:
+def parse_errors(files: dict, name: str) -> list:
     """
     Check is a sample processed by Bactopia has any errors.
 
     Args:
-        path (str): input directory to be checked
+        files (dict): file names and paths found in the sample directory
         name (str): the name of the sample
 
     Returns:
         list: observed error and a brief description
     """
     errors = []
-    for e in path.rglob("*-error.txt"):
-        error = e.name.split("-error.txt")[0].split("-", 1)[-1]
+    for filename in files:
+        if not filename.endswith("-error.txt"):
+            continue
+        error = filename.split("-error.txt")[0].split("-", 1)[-1]
         if error in ERROR_TYPES:
             errors.append(
                 {
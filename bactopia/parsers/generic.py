@@ -7,6 +7,9 @@ from typing import Union
 
 import yaml
 
+# Prefer libyaml's C loader, it is much faster than the pure Python loader
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 def parse_table(
     csvfile: str, delimiter: str = "\t", has_header: bool = True
@@ -58,4 +61,4 @@ def parse_yaml(yamlfile: str) -> Union[list, dict]:
         Union[list, dict]: the values parsed from the YAML file
     """
     with open(yamlfile, "rt") as fh:
-        return yaml.safe_load(fh)
+        return yaml.load(fh, Loader=SafeLoader)
@@ -2,6 +2,7 @@
 A list of files that can be parsed by Bactopia
 """
 import logging
+import os
 from pathlib import Path
 
 EXCLUDE_COLUMNS = [
@@ -22,7 +23,23 @@ EXCLUDE_COLUMNS = [
 ]
 
 
-def get_parsable_files(path: str, name: str) -> list:
+def _file_exists(filename: str, files: dict = None) -> bool:
+    """
+    Check if a file exists, using an index of the sample's files if available.
+
+    Args:
+        filename (str): the path to check
+        files (dict, optional): paths indexed by file name. Defaults to None.
+
+    Returns:
+        bool: the file exists (True) or not (False)
+    """
+    if files is None:
+        return Path(filename).exists()
+    return filename in files.get(os.path.basename(filename), [])
+
+
+def get_parsable_files(path: str, name: str, files: dict = None) -> list:
     parsable_files = {
         # main
         # assembler
@@ -42,17 +59,17 @@ def get_parsable_files(path: str, name: str) -> list:
     is_complete = True
     missing_files = []
     for output_file, output_type in parsable_files.items():
-        if not Path(output_file).exists():
+        if not _file_exists(output_file, files):
             is_complete = False
             missing_files.append(output_file)
 
     # Check annotation files seperately, since Prokka or Bakta can be used
-    if Path(f"{path}/main/annotator/bakta/{name}.txt").exists():
+    if _file_exists(f"{path}/main/annotator/bakta/{name}.txt", files):
         logging.debug(
             f"Found Bakta annotation file: {path}/main/annotator/bakta/{name}.txt"
         )
         parsable_files[f"{path}/main/annotator/bakta/{name}.txt"] = "annotator"
-    elif Path(f"{path}/main/annotator/prokka/{name}.txt").exists():
+    elif _file_exists(f"{path}/main/annotator/prokka/{name}.txt", files):
         logging.debug(
             f"Found Prokka annotation file: {path}/main/annotator/prokka/{name}.txt"
         )
@@ -1,17 +1,31 @@
 import gzip
+import hashlib
 import logging
+import os
+import pickle
+import shutil
 import sys
+import threading
+import time
+from functools import lru_cache, partial
 from pathlib import Path
 from sys import platform
 
 import requests
 import tqdm
 from executor import ExternalCommand, ExternalCommandFailed
-from tqdm.contrib.concurrent import process_map
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+GZIP_THREADS = 4
+GZIP_BLOCK_SIZE = 4096
 NCBI_GENOME_SIZE_URL = (
     "https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/species_genome_size.txt.gz"
 )
+BACTOPIA_CACHEDIR = os.getenv("BACTOPIA_CACHEDIR", f"{Path.home()}/.bactopia")
+NCBI_GENOME_SIZE_CACHE = f"{BACTOPIA_CACHEDIR}/ncbi-genome-sizes.pkl"
+NCBI_TAXID_CACHE = f"{BACTOPIA_CACHEDIR}/ncbi-taxids.pkl"
+NCBI_CACHE_MAX_AGE = 7 * 24 * 60 * 60
 
 
 def execute(
@@ -48,38 +62,41 @@ def execute(
             return None
 
 
-def pgzip(files: list, cpus: int) -> list:
+def split_gzip_cpus(cpus: int) -> tuple:
     """
-    Parallel gzip a list of files
+    Split cpus between concurrent gzip jobs and threads per job
+
+    pigz stops scaling well past a few threads per file, so when it is available
+    each file gets at most GZIP_THREADS threads and the rest go to more files.
 
     Args:
-        files (list): A list of files to gzip
         cpus (int): The number of cpus to use
 
     Returns:
-        list: A list of gzipped files
-    """
-    return process_map(
-        _gzip,
-        files,
-        max_workers=cpus,
-        chunksize=1,
-        bar_format="{l_bar}{bar:80}{r_bar}{bar:-80b}",
-        desc="Gzipping",
-    )
+        tuple: The number of concurrent jobs, and the threads to use per job
+    """
+    if cpus > 1 and shutil.which("pigz"):
+        threads = min(cpus, GZIP_THREADS)
+        return max(1, cpus // threads), threads
+    return cpus, 1
 
 
-def _gzip(filename: str) -> str:
+def gzip_file(filename: str, threads: int = 1) -> str:
     """
     Gzip a file
 
     Args:
         filename (str): The file to gzip
+        threads (int, optional): Threads to compress with, more than 1 requires pigz. Defaults to 1.
 
     Returns:
         str: The path to the gzipped file
     """
-    stdout, stderr = execute(f"gzip --force {filename}", capture=True, allow_fail=True)
+    if threads > 1:
+        cmd = f"pigz --force -p {threads} -b {GZIP_BLOCK_SIZE} {filename}"
+    else:
+        cmd = f"gzip --force {filename}"
+    stdout, stderr = execute(cmd, capture=True, allow_fail=True)
     return f"{filename}.gz"
 
 
@@ -129,6 +146,58 @@ def file_exists(filename: str) -> bool:
     return f.exists()
 
 
+def get_nextflow_config(bactopia_path: str, cache_dir: str) -> str:
+    """
+    Get Bactopia's flattened Nextflow config, cached between runs
+
+    Starting Nextflow takes a few seconds, so the output of `nextflow config -flat` is
+    reused until main.nf or any of the config files are modified.
+
+    Args:
+        bactopia_path (str): Directory where the Bactopia repository is stored
+        cache_dir (str): Directory to store the cached config in
+
+    Returns:
+        str: The flattened Nextflow config
+    """
+    configs = [f"{bactopia_path}/main.nf", f"{bactopia_path}/nextflow.config"]
+    for root, dirs, files in os.walk(f"{bactopia_path}/conf"):
+        configs.append(root)
+        configs.extend(f"{root}/{f}" for f in files if f.endswith(".config"))
+    mtime = max(
+        (os.stat(config).st_mtime_ns for config in configs if os.path.exists(config)),
+        default=0,
+    )
+    path_hash = hashlib.md5(bactopia_path.encode()).hexdigest()[:12]
+    cache = f"{cache_dir}/nf-config-{path_hash}-{mtime}.txt"
+    if os.path.exists(cache):
+        logging.debug(f"Using cached Nextflow config: {cache}")
+        with open(cache, "rt") as cache_fh:
+            return cache_fh.read()
+
+    nf_config, stderr = execute(
+        f"nextflow config -flat {bactopia_path}/main.nf", capture=True
+    )
+    try:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        with open(f"{cache}.tmp", "wt") as cache_fh:
+            cache_fh.write(nf_config)
+        os.replace(f"{cache}.tmp", cache)
+
+        # Configs cached before the latest change will not be used again
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if (
+                    entry.name.startswith(f"nf-config-{path_hash}-")
+                    and entry.name.endswith(".txt")
+                    and entry.path != cache
+                ):
+                    os.remove(entry.path)
+    except OSError as e:
+        logging.debug(f"Unable to cache Nextflow config to {cache}: {e}")
+    return nf_config
+
+
 def validate_file(filename: str) -> str:
     """
     Validate a file exists and return the absolute path
@@ -180,9 +249,64 @@ def remove_keys(results: dict, remove: list) -> dict:
     return removed
 
 
+def read_cache(cache: str, max_age: int = None):
+    """
+    Read a pickled cache, if it exists and is not too old
+
+    Args:
+        cache (str): Path to the cache file
+        max_age (int): Maximum age of the cache in seconds, no limit if None
+
+    Returns:
+        Any: The cached object, or None if there was no usable cache
+    """
+    try:
+        if max_age is not None and time.time() - os.path.getmtime(cache) > max_age:
+            return None
+        with open(cache, "rb") as cache_fh:
+            return pickle.load(cache_fh)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A truncated cache, or one written by other package versions, is a miss
+        logging.debug(f"Unable to read cache from {cache}: {e}")
+        return None
+
+
+def write_cache(cache: str, data) -> None:
+    """
+    Pickle an object to a cache file, a failure to write is not fatal
+
+    Args:
+        cache (str): Path to the cache file
+        data (Any): The object to cache
+    """
+    try:
+        Path(cache).parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{cache}.tmp", "wb") as cache_fh:
+            pickle.dump(data, cache_fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{cache}.tmp", cache)
+    except OSError as e:
+        logging.debug(f"Unable to write cache to {cache}: {e}")
+
+
+@lru_cache(maxsize=1)
+def read_taxid_cache() -> dict:
+    """
+    Read the species to tax_id lookups saved by previous runs
+
+    Returns:
+        dict: Species names associated with a tax_id and when it was looked up
+    """
+    return read_cache(NCBI_TAXID_CACHE) or {}
+
+
+@lru_cache(maxsize=None)
 def get_taxid_from_species(species: str) -> str:
     """
-    Convert a species name into a tax_id
+    Convert a species name into a tax_id, each species is only looked up once per run
+
+    Lookups are also cached in BACTOPIA_CACHEDIR and reused for up to a week.
 
     Args:
         species (str): A species name
@@ -190,6 +314,13 @@ def get_taxid_from_species(species: str) -> str:
     Returns:
         str: The corresponding tax_id
     """
+    taxids = read_taxid_cache()
+    if species in taxids:
+        taxid, looked_up = taxids[species]
+        if time.time() - looked_up < NCBI_CACHE_MAX_AGE:
+            logging.debug(f"Using cached taxon ID ({taxid}) for {species}")
+            return taxid
+
     r = requests.get(
         f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=taxonomy&term={species}"
     )
@@ -201,6 +332,8 @@ def get_taxid_from_species(species: str) -> str:
                 taxid = line.replace("<Id>", "").replace("</Id>", "")
         if taxid:
             logging.debug(f"Found taxon ID ({taxid}) for {species}")
+            taxids[species] = (taxid, time.time())
+            write_cache(NCBI_TAXID_CACHE, taxids)
             return taxid
         else:
             logging.error(
@@ -212,13 +345,21 @@ def get_taxid_from_species(species: str) -> str:
         sys.exit(1)
 
 
+@lru_cache(maxsize=1)
 def get_ncbi_genome_size() -> dict:
     """
     Get the NCBI's species genome size file.
 
+    The parsed file is cached in BACTOPIA_CACHEDIR and reused for up to a week.
+
     Returns:
         str: A dictionary of species genome sizes byt tax_id
     """
+    sizes = read_cache(NCBI_GENOME_SIZE_CACHE, NCBI_CACHE_MAX_AGE)
+    if sizes is not None:
+        logging.debug(f"Using cached NCBI genome sizes: {NCBI_GENOME_SIZE_CACHE}")
+        return sizes
+
     r = requests.get(NCBI_GENOME_SIZE_URL, stream=True)
     if r.status_code == requests.codes.ok:
         sizes = {}
@@ -232,6 +373,8 @@ def get_ncbi_genome_size() -> dict:
                 else:
                     hit = dict(zip(header, cols))
                     sizes[hit["#species_taxid"]] = hit
+
+        write_cache(NCBI_GENOME_SIZE_CACHE, sizes)
         return sizes
     else:
         logging.error(
@@ -240,7 +383,55 @@ def get_ncbi_genome_size() -> dict:
         sys.exit(1)
 
 
-def download_url(url: str, save_path: str, show_progress: bool) -> str:
+def get_session(pool_size: int = 10, retries: int = 5) -> requests.Session:
+    """
+    Create a requests Session that reuses connections and retries failures
+
+    Args:
+        pool_size (int): The number of connections to keep open per host
+        retries (int): The number of times to retry a failed request
+
+    Returns:
+        requests.Session: A session to share across requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries, backoff_factor=1, status_forcelist=[500, 502, 503, 504]
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def file_md5(filename: str) -> str:
+    """
+    Calculate the MD5 checksum of a file
+
+    Args:
+        filename (str): The file to checksum
+
+    Returns:
+        str: The hex digest of the file's MD5
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as fh:
+        for block in iter(partial(fh.read, 1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def download_url(
+    url: str,
+    save_path: str,
+    show_progress: bool,
+    session: requests.Session = None,
+    md5: str = None,
+    stop: threading.Event = None,
+) -> str:
     """
     Download a file from a URL
 
@@ -250,32 +441,87 @@ def download_url(url: str, save_path: str, show_progress: bool) -> str:
         url (str): The URL to download
         save_path (str): The path to save the downloaded file
         show_progress (bool): Show a progress bar while downloading
+        session (requests.Session, optional): A session to reuse connections from. Defaults to None.
+        md5 (str, optional): The expected MD5 of the file. Defaults to None.
+        stop (threading.Event, optional): Stop downloading once set, keeping the partial download. Defaults to None.
 
     Returns:
-        str: The path to the downloaded file
+        str: The path to the downloaded file, or None if stopped early
     """
-    r = requests.get(url, stream=True)
-    if r.status_code == requests.codes.ok:
-        total_size = int(r.headers.get("content-length", 0))
-        with open(save_path, "wb") as f:
-            if show_progress:
-                with tqdm.tqdm(
-                    desc=save_path,
-                    total=total_size,
-                    unit="B",
-                    unit_scale=True,
-                    bar_format="{l_bar}{bar:80}{r_bar}{bar:-80b}",
-                ) as pbar:
-                    for data in r.iter_content(chunk_size=1024):
-                        f.write(data)
-                        pbar.update(len(data))
-            else:
-                for data in r.iter_content(chunk_size=1024):
-                    f.write(data)
+    # Resume a previous partial download, but only if the server still has the same
+    # file (If-Range), otherwise it sends the whole file again
+    part_path = f"{save_path}.part"
+    validator_path = f"{part_path}.validator"
+    resume_from = 0
+    headers = None
+    if os.path.exists(part_path) and os.path.exists(validator_path):
+        with open(validator_path, "rt") as fh:
+            validator = fh.read().strip()
+        resume_from = os.path.getsize(part_path)
+        if resume_from and validator:
+            headers = {"Range": f"bytes={resume_from}-", "If-Range": validator}
+        else:
+            resume_from = 0
+
+    requester = session or requests
+    r = requester.get(url, stream=True, headers=headers)
+    is_complete = False
+    if r.status_code == requests.codes.requested_range_not_satisfiable:
+        r.close()
+        if r.headers.get("content-range") == f"bytes */{resume_from}":
+            # The previous run finished downloading, but never moved the file
+            is_complete = True
+        else:
+            resume_from = 0
+            r = requester.get(url, stream=True)
+
+    if is_complete:
+        logging.debug(f"Partial download is already complete: {part_path}")
+    elif r.status_code in [requests.codes.ok, requests.codes.partial_content]:
+        if r.status_code == requests.codes.ok:
+            # Server ignored the range request or the file changed, start over
+            resume_from = 0
+            validator = r.headers.get("etag", "")
+            if not validator or validator.startswith("W/"):
+                # Weak ETags can't be used with If-Range
+                validator = r.headers.get("last-modified", "")
+            with open(validator_path, "wt") as fh:
+                fh.write(validator)
+        total_size = int(r.headers.get("content-length", 0)) + resume_from
+        with open(part_path, "ab" if resume_from else "wb") as f, tqdm.tqdm(
+            desc=save_path,
+            total=total_size,
+            initial=resume_from,
+            unit="B",
+            unit_scale=True,
+            bar_format="{l_bar}{bar:80}{r_bar}{bar:-80b}",
+            disable=not show_progress,
+        ) as pbar:
+            for data in r.iter_content(chunk_size=1024 * 1024):
+                if stop is not None and stop.is_set():
+                    break
+                f.write(data)
+                pbar.update(len(data))
+        r.close()
     else:
         logging.error(f"Unable to download {url}, please try again later.")
         sys.exit(1)
 
+    if stop is not None and stop.is_set():
+        # Keep the partial download, a later run can resume it
+        logging.debug(f"Stopped downloading {url}")
+        return None
+
+    if md5 and file_md5(part_path) != md5:
+        os.remove(part_path)
+        os.remove(validator_path)
+        logging.error(
+            f"Downloaded {url} does not match its MD5 ({md5}), please try again."
+        )
+        sys.exit(1)
+    os.replace(part_path, save_path)
+    os.remove(validator_path)
+
     return validate_file(save_path)
 
 